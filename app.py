@@ -20,17 +20,17 @@ def gate():
     st.stop()
 gate()
 
-# --- Initialize database tables ---
-from database import init_db
+# --- Initialize database tables (once per process, cached) ---
+from database import init_db, session_scope, get_pool_stats
 init_db()
 
-# --- Import your pages (top-level .py files) ---
-import dashboard, ingredients, inventory_alerts, profit_analysis, recipes, suppliers, square_setup
+# --- Pages are imported on first selection (see page_registry.py) ---
+from page_registry import page_labels, load_page, IMPORT_TIMES
 
 st.sidebar.title("🍰 Ohh Crumbs")
 page = st.sidebar.radio(
     "Go to",
-    ["🏠 Dashboard","🥖 Ingredients","📖 Recipes","🔔 Inventory Alerts","💰 Profit Analysis","📦 Suppliers","🔗 Square Setup"],
+    page_labels(),
     label_visibility="collapsed",
 )
 
@@ -40,13 +40,17 @@ def call(mod, func):
     else:
         st.warning(f"`{mod.__name__}.{func}()` not found.")
 
-if page.startswith("🏠"): call(dashboard, "show_dashboard")
-elif page.startswith("🥖"): call(ingredients, "show_ingredients")
-elif page.startswith("📖"): call(recipes, "show_recipes")
-elif page.startswith("🔔"): call(inventory_alerts, "show_inventory_alerts")
-elif page.startswith("💰"): call(profit_analysis, "show_profit_analysis")
-elif page.startswith("📦"): call(suppliers, "show_suppliers")
-elif page.startswith("🔗"): call(square_setup, "show_square_setup")
+# One database session per script run, shared by the page and its helpers
+with session_scope():
+    call(*load_page(page))
 
 st.sidebar.markdown("---")
 st.sidebar.caption("Add to Home Screen on iPhone for an app-like icon.")
+
+if st.secrets.get("SHOW_POOL_STATS", False):
+    with st.sidebar.expander("Connection pool"):
+        st.json(get_pool_stats())
+
+if st.secrets.get("SHOW_IMPORT_TIMES", False):
+    with st.sidebar.expander("Page import times"):
+        st.json({module: f"{seconds * 1000:.0f} ms" for module, seconds in IMPORT_TIMES.items()})
@@ -0,0 +1,90 @@
+from datetime import datetime
+from sqlalchemy import func
+from models import RecipeItem, SalesCache
+from data_versions import cached_on
+
+class BillOfMaterials:
+    """
+    Recipe -> ingredient quantity matrix built from RecipeItem.
+    matrix[i, j] is how much of ingredient_ids[j] one unit of recipe_ids[i] uses.
+    """
+    def __init__(self, recipe_ids, ingredient_ids, matrix):
+        self.recipe_ids = recipe_ids
+        self.ingredient_ids = ingredient_ids
+        self.matrix = matrix
+
+    @classmethod
+    def from_items(cls, items):
+        """Build from (recipe_id, ingredient_id, quantity) tuples"""
+        import numpy as np
+
+        recipe_ids = sorted({recipe_id for recipe_id, _, _ in items})
+        ingredient_ids = sorted({ingredient_id for _, ingredient_id, _ in items})
+        recipe_index = {recipe_id: i for i, recipe_id in enumerate(recipe_ids)}
+        ingredient_index = {ingredient_id: j for j, ingredient_id in enumerate(ingredient_ids)}
+
+        matrix = np.zeros((len(recipe_ids), len(ingredient_ids)))
+        for recipe_id, ingredient_id, quantity in items:
+            matrix[recipe_index[recipe_id], ingredient_index[ingredient_id]] += quantity or 0.0
+
+        return cls(recipe_ids, ingredient_ids, matrix)
+
+    def explode(self, production):
+        """
+        Turn a recipes x periods production (or sales) DataFrame, indexed by
+        recipe id, into an ingredients x periods usage DataFrame in one multiply.
+        Recipes with no ingredients contribute nothing.
+        """
+        import pandas as pd
+
+        aligned = production.reindex(index=self.recipe_ids, fill_value=0).fillna(0)
+        usage = self.matrix.T @ aligned.to_numpy(dtype=float)
+        return pd.DataFrame(usage, index=pd.Index(self.ingredient_ids, name='ingredient_id'), columns=production.columns)
+
+    def plan(self, quantities):
+        """Ingredient demand for a hypothetical bake: {recipe_id: units} -> Series by ingredient id"""
+        import pandas as pd
+
+        production = pd.DataFrame({'quantity': pd.Series(quantities, dtype=float)})
+        return self.explode(production)['quantity']
+
+
+@cached_on('recipes', 'recipe_items')
+def get_bom(session):
+    """
+    Process-wide cached BOM, rebuilt once a committed write to recipes or
+    recipe items (ORM or bulk) bumps their data version. The cached instance
+    is shared between callers, so treat it as read-only.
+    """
+    items = session.query(RecipeItem.recipe_id, RecipeItem.ingredient_id, RecipeItem.quantity).all()
+    return BillOfMaterials.from_items(items)
+
+def get_sales_matrix(session, start_date, end_date=None):
+    """Units sold as a recipes x days DataFrame (index recipe id, columns dates)"""
+    import pandas as pd
+
+    end_date = end_date or datetime.utcnow()
+    day = func.date(SalesCache.timestamp)
+
+    rows = session.query(
+        SalesCache.recipe_id,
+        day,
+        func.sum(SalesCache.quantity)
+    ).filter(
+        SalesCache.recipe_id.isnot(None),
+        SalesCache.timestamp >= start_date,
+        SalesCache.timestamp <= end_date
+    ).group_by(SalesCache.recipe_id, day).all()
+
+    days = pd.date_range(pd.Timestamp(start_date).normalize(), pd.Timestamp(end_date).normalize(), freq='D').date
+    if not rows:
+        return pd.DataFrame(index=pd.Index([], name='recipe_id'), columns=days, dtype=float)
+
+    sales = pd.DataFrame(rows, columns=['recipe_id', 'date', 'quantity'])
+    sales['date'] = pd.to_datetime(sales['date']).dt.date
+    matrix = sales.pivot_table(index='recipe_id', columns='date', values='quantity', aggfunc='sum', fill_value=0)
+    return matrix.reindex(columns=days, fill_value=0)
+
+def get_ingredient_usage(session, start_date, end_date=None):
+    """Ingredient usage per day over any date range: BOM^T x sales matrix"""
+    return get_bom(session).explode(get_sales_matrix(session, start_date, end_date))
@@ -0,0 +1,111 @@
+"""
+Delta import of Square catalog items into recipes.
+
+Each run asks Square only for items changed since the catalog latest_time
+stored by the previous run, and skips items whose object version matches
+the one stored on the recipe. One recipe per Square item; every variation
+id becomes an alias so sales map back to it.
+"""
+from sqlalchemy import insert, select, update
+from models import Recipe, RecipeAlias
+from database import get_setting, set_setting
+from sales_ingest import backfill_recipe_ids
+
+CATALOG_TIME_KEY = 'square_catalog_latest_time'
+DEFAULT_CATEGORY = 'Imported from Square'
+
+def _name_key(name):
+    return (name or '').strip().lower()
+
+def import_catalog(session, square_api, full=False):
+    """
+    Create or update recipes from Square catalog items changed since the last
+    import (every item when full is True). Creates, updates and aliases are
+    each written in one bulk statement. Returns a dict of counts.
+    """
+    begin_time = None if full else get_setting(session, CATALOG_TIME_KEY)
+    items, latest_time = square_api.search_catalog_items(begin_time=begin_time)
+
+    linked = {}
+    unlinked = {}
+    for recipe_id, name, square_item_id, square_version in session.execute(
+        select(Recipe.id, Recipe.name, Recipe.square_item_id, Recipe.square_version)
+    ):
+        if square_item_id:
+            linked[square_item_id] = (recipe_id, square_version)
+        else:
+            unlinked[_name_key(name)] = recipe_id
+    taken_names = {_name_key(name) for (name,) in session.execute(select(Recipe.name))}
+
+    creates = []
+    updates = []
+    touched = []
+    counts = {'imported': 0, 'updated': 0, 'unchanged': 0, 'deleted': 0, 'skipped': 0}
+
+    for item in items:
+        if item['is_deleted']:
+            # Recipes hold local ingredient data, so a deleted Square item keeps its recipe
+            counts['deleted'] += 1
+            continue
+
+        if item['id'] in linked:
+            recipe_id, version = linked[item['id']]
+            if version is not None and item['version'] is not None and item['version'] <= version:
+                counts['unchanged'] += 1
+                continue
+            updates.append({'id': recipe_id, 'sale_price': item['price'], 'square_version': item['version']})
+        elif _name_key(item['name']) in unlinked:
+            # A recipe created by hand before the import: link it rather than duplicate the name
+            recipe_id = unlinked.pop(_name_key(item['name']))
+            updates.append({
+                'id': recipe_id, 'square_item_id': item['id'], 'sale_price': item['price'], 'square_version': item['version']
+            })
+        elif _name_key(item['name']) in taken_names:
+            counts['skipped'] += 1
+            continue
+        else:
+            taken_names.add(_name_key(item['name']))
+            creates.append(item)
+            continue
+
+        counts['updated'] += 1
+        touched.append((recipe_id, item))
+
+    if creates:
+        categories = square_api.get_category_names(item['category_id'] for item in creates)
+        session.execute(insert(Recipe), [{
+            'name': item['name'],
+            'square_item_id': item['id'],
+            'square_version': item['version'],
+            'sale_price': item['price'],
+            'category': categories.get(item['category_id'], DEFAULT_CATEGORY)
+        } for item in creates])
+
+        created_ids = dict(session.execute(
+            select(Recipe.square_item_id, Recipe.id).where(Recipe.square_item_id.in_([item['id'] for item in creates]))
+        ).all())
+        touched.extend((created_ids[item['id']], item) for item in creates)
+        counts['imported'] = len(creates)
+
+    if updates:
+        session.execute(update(Recipe), updates)
+
+    # Sales carry the variation id, so map each one back to its item's recipe
+    known_aliases = {alias for (alias,) in session.execute(select(RecipeAlias.alias))}
+    aliases = []
+    for recipe_id, item in touched:
+        for variation in item['variations']:
+            if variation['id'] and variation['id'] not in known_aliases:
+                known_aliases.add(variation['id'])
+                aliases.append({'recipe_id': recipe_id, 'alias': variation['id']})
+    if aliases:
+        session.execute(insert(RecipeAlias), aliases)
+
+    if latest_time:
+        set_setting(session, CATALOG_TIME_KEY, latest_time)
+    session.commit()
+
+    if touched:
+        backfill_recipe_ids(session)
+
+    return counts
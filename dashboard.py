@@ -1,33 +1,48 @@
 import streamlit as st
 from database import get_session, close_session
 from utils import get_sales_summary, generate_business_recommendations, auto_sync_square_sales
-from models import SalesCache, Recipe
-from utils import calculate_profit_margin
-from sqlalchemy import func
-import plotly.express as px
-import plotly.graph_objects as go
+from models import Recipe
+from utils import calculate_profit_margin, get_units_sold_by_recipe
 from datetime import datetime, timedelta
-import pandas as pd
-from pdf_reports import generate_sales_report
+from sales_rollup import get_daily_totals, get_top_items
 from styling import inject_custom_css, render_page_header
 
+DAY_OPTIONS = [7, 14, 30, 60, 90]
+
 def show_dashboard():
     inject_custom_css()
 
     render_page_header("🧁 Ohh Crumbs", "CAKE AND CRUMBLE")
 
-    # Auto-sync Square sales data (runs once per hour due to cache)
+    # Incrementally sync new Square sales (runs at most every 5 minutes due to cache)
     sync_result = auto_sync_square_sales(days_back=30)
     if sync_result and sync_result.get('imported', 0) > 0:
         st.toast(f"✅ Synced {sync_result['imported']} new sales from Square", icon="🔄")
 
+    # Each section is a fragment: changing the time period reruns only the
+    # sales overview, not the sync check or the recommendations
+    show_sales_overview()
+
+    st.divider()
+
+    show_recommendations()
+
+    st.divider()
+
+    show_report_export()
+
+@st.fragment
+def show_sales_overview():
+    import pandas as pd
+    import plotly.express as px
+
     session = get_session()
 
     try:
         # Time period selector
         col_space, col_select = st.columns([3, 1])
         with col_select:
-            days_back = st.selectbox("Time Period", [7, 14, 30, 60, 90], index=2)
+            days_back = st.selectbox("Time Period", DAY_OPTIONS, index=2, key="dashboard_days")
 
         st.markdown("<br>", unsafe_allow_html=True)
 
@@ -66,43 +81,15 @@ def show_dashboard():
         st.markdown("<br>", unsafe_allow_html=True)
         st.divider()
 
-        st.subheader("💡 Business Recommendations")
-
-        recommendations = generate_business_recommendations(session)
-
-        if recommendations:
-            for rec in recommendations:
-                if rec['priority'] == 'critical':
-                    st.error(f"🚨 {rec['message']}")
-                elif rec['priority'] == 'high':
-                    st.success(f"⭐ {rec['message']}")
-                elif rec['priority'] == 'medium':
-                    st.info(f"💡 {rec['message']}")
-                else:
-                    st.info(f"✨ {rec['message']}")
-        else:
-            st.info("✨ No recommendations at this time. Keep adding sales data and recipes for insights!")
-
-        st.divider()
-
-        sales_data = session.query(SalesCache).filter(
-            SalesCache.timestamp >= start_date
-        ).order_by(SalesCache.timestamp).all()
+        daily_totals = get_daily_totals(session, start_date)
 
-        if sales_data:
+        if daily_totals:
             st.subheader("📈 Sales Trends")
 
-            df = pd.DataFrame([{
-                'date': sale.timestamp.date(),
-                'item': sale.item_name,
-                'quantity': sale.quantity,
-                'amount': sale.total_amount
-            } for sale in sales_data])
-
-            daily_sales = df.groupby('date').agg({
-                'amount': 'sum',
-                'quantity': 'sum'
-            }).reset_index()
+            daily_sales = pd.DataFrame(
+                [(day.date(), amount, quantity) for day, amount, quantity in daily_totals],
+                columns=['date', 'amount', 'quantity']
+            )
 
             # Pastel pink themed chart
             fig_revenue = px.line(
@@ -138,10 +125,10 @@ def show_dashboard():
             st.markdown("<br>", unsafe_allow_html=True)
             st.subheader("🏆 Top Selling Items")
 
-            top_items = df.groupby('item').agg({
-                'quantity': 'sum',
-                'amount': 'sum'
-            }).reset_index().sort_values('quantity', ascending=False).head(10)
+            top_items = pd.DataFrame(
+                get_top_items(session, start_date, limit=10),
+                columns=['item', 'quantity', 'amount']
+            )
 
             # Pastel pink themed bar chart
             fig_items = px.bar(
@@ -176,19 +163,52 @@ def show_dashboard():
         else:
             st.info("📭 No sales data available yet. Connect to Square API or add manual sales entries.")
 
-        st.divider()
+    finally:
+        close_session(session)
+
+def show_recommendations():
+    session = get_session()
+
+    try:
+        st.subheader("💡 Business Recommendations")
+
+        recommendations = generate_business_recommendations(session)
+
+        if recommendations:
+            for rec in recommendations:
+                if rec['priority'] == 'critical':
+                    st.error(f"🚨 {rec['message']}")
+                elif rec['priority'] == 'high':
+                    st.success(f"⭐ {rec['message']}")
+                elif rec['priority'] == 'medium':
+                    st.info(f"💡 {rec['message']}")
+                else:
+                    st.info(f"✨ {rec['message']}")
+        else:
+            st.info("✨ No recommendations at this time. Keep adding sales data and recipes for insights!")
+
+    finally:
+        close_session(session)
+
+@st.fragment
+def show_report_export():
+    session = get_session()
+
+    try:
+        # Uses the period picked in the sales overview fragment
+        days_back = st.session_state.get("dashboard_days", DAY_OPTIONS[2])
+        start_date = datetime.utcnow() - timedelta(days=days_back)
+        end_date = datetime.utcnow()
 
         st.subheader("📄 Export Reports")
 
         if st.button("📥 Generate PDF Sales Report", use_container_width=True):
             recipes = session.query(Recipe).all()
+            units_sold = get_units_sold_by_recipe(session, start_date=start_date)
             sales_data_for_pdf = []
 
             for recipe in recipes:
-                sales_count = session.query(func.sum(SalesCache.quantity)).filter(
-                    SalesCache.item_name == recipe.name,
-                    SalesCache.timestamp >= start_date
-                ).scalar() or 0
+                sales_count = units_sold.get(recipe.id, 0)
 
                 if sales_count > 0:
                     total_revenue = recipe.sale_price * sales_count
@@ -200,6 +220,8 @@ def show_dashboard():
                     })
 
             if sales_data_for_pdf:
+                import pandas as pd
+                from pdf_reports import generate_sales_report
                 df_pdf = pd.DataFrame(sales_data_for_pdf)
                 pdf_bytes = generate_sales_report(df_pdf, start_date, end_date)
 
@@ -214,4 +236,4 @@ def show_dashboard():
                 st.warning("No sales data available to generate report.")
 
     finally:
-        close_session(session)
\ No newline at end of file
+        close_session(session)
@@ -0,0 +1,131 @@
+"""
+Per-table data versions for caching derived analytics.
+
+ORM flushes and bulk statements record the tables they write in
+session.info; once the transaction commits, a counter row per table in
+Settings ("data_version:<table>") is bumped in its own short transaction,
+so a commit from any session or process invalidates cached results and a
+rollback bumps nothing.
+"""
+import functools
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from sqlalchemy import event, select, update, insert, cast, Integer, String
+from sqlalchemy.engine import Connection
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from models import Settings
+
+VERSION_KEY = 'data_version:{table}'
+UNTRACKED_TABLES = {'settings', 'schema_migrations'}
+PENDING_KEY = 'data_versions_pending'
+MAX_ENTRIES = 64
+
+def _bump_table(conn, key):
+    settings = Settings.__table__
+    bumped = conn.execute(
+        update(settings).where(settings.c.key == key).values(
+            value=cast(cast(settings.c.value, Integer) + 1, String)
+        )
+    ).rowcount
+    if not bumped:
+        conn.execute(insert(settings).values(key=key, value='1'))
+
+def _bump(bind, tables):
+    for table in sorted(set(tables) - UNTRACKED_TABLES):
+        key = VERSION_KEY.format(table=table)
+        if isinstance(bind, Connection):
+            # A session joined to an outer transaction (migrations): bump inside it
+            _bump_table(bind, key)
+            continue
+        try:
+            with bind.begin() as conn:
+                _bump_table(conn, key)
+        except IntegrityError:
+            # Another process created the row first; bump the one it made
+            with bind.begin() as conn:
+                _bump_table(conn, key)
+
+def _record(session, tables):
+    session.info.setdefault(PENDING_KEY, set()).update(tables)
+
+def has_pending_writes(session):
+    """True while the session holds writes whose table versions haven't been bumped yet"""
+    return bool(session.info.get(PENDING_KEY) or session.new or session.dirty or session.deleted)
+
+@event.listens_for(Session, 'after_flush')
+def _record_flushed_tables(session, flush_context):
+    changed = list(session.new) + list(session.deleted) + [obj for obj in session.dirty if session.is_modified(obj)]
+    tables = {obj.__table__.name for obj in changed}
+    if tables:
+        _record(session, tables)
+
+@event.listens_for(Session, 'do_orm_execute')
+def _record_bulk_statement_tables(orm_execute_state):
+    # Bulk INSERT/UPDATE/DELETE statements (including Query.update/delete) skip the flush
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        _record(orm_execute_state.session, [orm_execute_state.statement.table.name])
+
+@event.listens_for(Session, 'after_commit')
+def _bump_committed_tables(session):
+    tables = session.info.pop(PENDING_KEY, None)
+    if tables:
+        _bump(session.get_bind(), tables)
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _discard_rolled_back_tables(session, previous_transaction):
+    # A savepoint rollback leaves the outer transaction's earlier writes pending
+    if not previous_transaction.nested:
+        session.info.pop(PENDING_KEY, None)
+
+def get_versions(session, tables):
+    """Current version of each table, 0 for tables never written since versioning began"""
+    keys = {VERSION_KEY.format(table=table): table for table in tables}
+    rows = dict(session.execute(select(Settings.key, Settings.value).where(Settings.key.in_(keys))).all())
+    return tuple(int(rows.get(key) or 0) for key in keys)
+
+
+def _copy(result):
+    # Shallow copy dicts, lists and DataFrames so callers can't mutate the cached value
+    return result.copy() if hasattr(result, 'copy') else result
+
+def cached_on(*tables):
+    """
+    Cache a function(session, ...) until one of the tables it reads changes.
+    The key is the remaining arguments, the tables' versions and today's date,
+    so day-window queries roll over at midnight UTC. Results must not hold ORM
+    objects, since they outlive the session that loaded them. A session with
+    uncommitted writes bypasses the cache, since it sees data the versions
+    don't cover yet.
+    """
+    def decorator(func):
+        cache = OrderedDict()
+        lock = threading.Lock()
+
+        @functools.wraps(func)
+        def wrapper(session, *args, **kwargs):
+            if has_pending_writes(session):
+                return func(session, *args, **kwargs)
+
+            key = (args, tuple(sorted(kwargs.items())), get_versions(session, tables), datetime.utcnow().date())
+
+            with lock:
+                if key in cache:
+                    cache.move_to_end(key)
+                    return _copy(cache[key])
+
+            result = func(session, *args, **kwargs)
+            if has_pending_writes(session):
+                # The call flushed writes of its own, so the result isn't covered by key
+                return result
+
+            with lock:
+                cache[key] = result
+                while len(cache) > MAX_ENTRIES:
+                    cache.popitem(last=False)
+            return _copy(result)
+
+        wrapper.cache_clear = cache.clear
+        return wrapper
+    return decorator
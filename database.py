@@ -1,6 +1,8 @@
 import os
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, scoped_session
+import threading
+from contextlib import contextmanager
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
 from models import Base
 import streamlit as st
 
@@ -21,37 +23,179 @@ def get_engine():
             pool_recycle=300,
             echo=False
         )
+        
+        engine.pool_checkouts = 0
+        
+        @event.listens_for(engine, 'checkout')
+        def _count_checkout(dbapi_connection, connection_record, connection_proxy):
+            engine.pool_checkouts += 1
+        
         return engine
     except Exception as e:
         st.error(f"Failed to connect to database: {str(e)}")
         st.stop()
 
+@st.cache_resource
 def init_db():
-    engine = get_engine()
-    Base.metadata.create_all(engine)
-    
-    from sqlalchemy import text, inspect
+    """
+    Bring the schema up to date once per process. Reruns hit the cache, and a
+    database already at the latest version gets no DDL at all.
+    """
+    from migrations import get_schema_version, run_migrations, LATEST_VERSION
     
-    inspector = inspect(engine)
+    engine = get_engine()
+    if get_schema_version(engine) < LATEST_VERSION:
+        run_migrations(engine)
+    return LATEST_VERSION
+
+@st.cache_resource
+def get_session_factory():
+    return sessionmaker(bind=get_engine())
+
+_request = threading.local()
+
+@contextmanager
+def session_scope():
+    """
+    One session per script run. The outermost scope opens the session, commits
+    on success, rolls back on error and closes it; nested scopes and
+    get_session() calls inside it share the same session.
+    """
+    session = getattr(_request, 'session', None)
+    if session is not None:
+        yield session
+        return
     
-    with engine.connect() as conn:
-        existing_tables = inspector.get_table_names()
-        
-        if 'ingredients' in existing_tables:
-            columns = [col['name'] for col in inspector.get_columns('ingredients')]
-            
-            if 'supplier_id' not in columns:
-                try:
-                    conn.execute(text("ALTER TABLE ingredients ADD COLUMN supplier_id INTEGER REFERENCES suppliers(id)"))
-                    conn.commit()
-                except Exception:
-                    pass
+    session = get_session_factory()()
+    _request.session = session
+    try:
+        yield session
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        _request.session = None
+        session.close()
 
 def get_session():
-    engine = get_engine()
-    Session = scoped_session(sessionmaker(bind=engine))
-    return Session()
+    """The current request session inside session_scope(), otherwise a new one the caller closes"""
+    session = getattr(_request, 'session', None)
+    if session is not None:
+        return session
+    return get_session_factory()()
 
 def close_session(session):
-    if session:
+    # The request session is closed by the session_scope that opened it
+    if session and session is not getattr(_request, 'session', None):
         session.close()
+
+def get_pool_stats():
+    """Connection pool usage for the process-wide engine"""
+    engine = get_engine()
+    pool = engine.pool
+    return {
+        'pool': pool.status(),
+        'size': pool.size() if hasattr(pool, 'size') else None,
+        'checked_out': pool.checkedout() if hasattr(pool, 'checkedout') else None,
+        'overflow': pool.overflow() if hasattr(pool, 'overflow') else None,
+        'total_checkouts': getattr(engine, 'pool_checkouts', 0)
+    }
+
+def get_setting(session, key):
+    from models import Settings
+    setting = session.query(Settings).filter_by(key=key).first()
+    return setting.value if setting else None
+
+def set_setting(session, key, value):
+    """Stage a Settings value; the caller commits"""
+    from models import Settings
+    setting = session.query(Settings).filter_by(key=key).first()
+    if setting:
+        setting.value = value
+    else:
+        session.add(Settings(key=key, value=value))
+
+def compare_and_set_setting(session, key, expected, value):
+    """
+    Move a Settings value from expected (None: no row yet) to value inside the
+    caller's transaction. Returns False when another transaction changed it
+    first, in which case the caller should roll back and re-read.
+    """
+    from sqlalchemy import insert, update
+    from sqlalchemy.exc import IntegrityError
+    from models import Settings
+    settings = Settings.__table__
+
+    if expected is None:
+        try:
+            with session.begin_nested():
+                session.execute(insert(settings).values(key=key, value=value))
+            return True
+        except IntegrityError:
+            return False
+
+    return session.execute(
+        update(settings).where(settings.c.key == key, settings.c.value == expected).values(value=value)
+    ).rowcount == 1
+
+def lock_setting(session, key):
+    """
+    Hold a row lock on the Settings row key (created if missing) until the
+    caller's transaction ends, so transactions that take it run one at a time.
+    SQLite has no FOR UPDATE; it already lets only one transaction write.
+    """
+    from sqlalchemy import select
+    from models import Settings
+
+    compare_and_set_setting(session, key, None, '')
+    session.execute(select(Settings.id).where(Settings.key == key).with_for_update()).scalar()
+
+def upsert_increment(session, model, rows, index_elements, increment_columns, chunk_size=500):
+    """
+    Insert rows, or add increment_columns onto the existing row when the
+    index_elements key already exists. Uses ON CONFLICT DO UPDATE on Postgres
+    and SQLite, and one lookup per chunk elsewhere.
+    """
+    from sqlalchemy import tuple_
+    
+    dialect = session.get_bind().dialect.name
+    
+    for start in range(0, len(rows), chunk_size):
+        chunk = rows[start:start + chunk_size]
+        
+        if dialect in ('postgresql', 'sqlite'):
+            if dialect == 'postgresql':
+                from sqlalchemy.dialects.postgresql import insert as dialect_insert
+            else:
+                from sqlalchemy.dialects.sqlite import insert as dialect_insert
+            
+            stmt = dialect_insert(model).values(chunk)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=index_elements,
+                set_={
+                    column: getattr(model, column) + getattr(stmt.excluded, column)
+                    for column in increment_columns
+                }
+            )
+            session.execute(stmt)
+            continue
+        
+        key_columns = [getattr(model, column) for column in index_elements]
+        existing = {
+            tuple(getattr(obj, column) for column in index_elements): obj
+            for obj in session.query(model).filter(
+                tuple_(*key_columns).in_([tuple(row[column] for column in index_elements) for row in chunk])
+            )
+        }
+        for row in chunk:
+            obj = existing.get(tuple(row[column] for column in index_elements))
+            if obj:
+                for column in increment_columns:
+                    setattr(obj, column, (getattr(obj, column) or 0) + row[column])
+            else:
+                session.add(model(**row))
+
+# Register the Session hooks that keep data versions and recipe costs current
+import data_versions
+import recipe_costing
@@ -0,0 +1,327 @@
+"""
+Local fake of the Square endpoints SquareAPI uses, for testing and
+benchmarking fetches offline. It serves a deterministic set of orders and
+payments and can inject 429s (with Retry-After), 5xx errors and latency.
+
+    python fake_square.py serve --port 8765 --rate-429 0.1
+    SQUARE_ACCESS_TOKEN=fake SQUARE_LOCATION_ID=LFAKE SQUARE_BASE_URL=http://127.0.0.1:8765 streamlit run app.py
+
+    python fake_square.py bench    # throughput of get_orders under throttling
+"""
+import json
+import random
+import threading
+import time
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+LOCATION_ID = 'LFAKE'
+ITEMS = ['Victoria Sponge', 'Apple Crumble', 'Brownie', 'Lemon Drizzle', 'Carrot Cake', 'Flapjack']
+
+def _timestamp(value):
+    return value.strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z'
+
+def make_orders(count=1000, days=90, seed=1):
+    """count orders spread over the last days days, 1-3 line items each"""
+    rng = random.Random(seed)
+    now = datetime.utcnow()
+    orders = []
+
+    for i in range(count):
+        created = now - timedelta(seconds=rng.uniform(0, days * 86400))
+        updated = min(now, created + timedelta(seconds=rng.uniform(0, 3600)))
+        line_items = []
+        for position in range(rng.randint(1, 3)):
+            name = rng.choice(ITEMS)
+            quantity = rng.randint(1, 4)
+            line_items.append({
+                'uid': f"line-{i}-{position}",
+                'name': name,
+                'quantity': str(quantity),
+                'catalog_object_id': f"VAR-{ITEMS.index(name)}",
+                'total_money': {'amount': quantity * 350, 'currency': 'GBP'}
+            })
+
+        orders.append({
+            'id': f"ORDER{i:06d}",
+            'location_id': LOCATION_ID,
+            'state': 'COMPLETED',
+            'created_at': _timestamp(created),
+            'updated_at': _timestamp(updated),
+            'line_items': line_items
+        })
+
+    return orders
+
+def make_payments(orders):
+    return [{
+        'id': f"PAY{order['id'][5:]}",
+        'location_id': LOCATION_ID,
+        'status': 'COMPLETED',
+        'created_at': order['created_at'],
+        'receipt_number': order['id'][-4:],
+        'total_money': {'amount': sum(line['total_money']['amount'] for line in order['line_items']), 'currency': 'GBP'}
+    } for order in orders]
+
+
+def make_catalog(now=None):
+    """One ITEM per name in ITEMS (two variations each) and their categories"""
+    updated = _timestamp(now or datetime.utcnow())
+    categories = [
+        {'type': 'CATEGORY', 'id': 'CAT-CAKES', 'version': 1, 'updated_at': updated, 'category_data': {'name': 'Cakes'}},
+        {'type': 'CATEGORY', 'id': 'CAT-BAKES', 'version': 1, 'updated_at': updated, 'category_data': {'name': 'Traybakes'}},
+    ]
+    items = [{
+        'type': 'ITEM',
+        'id': f"ITEM-{index}",
+        'version': 1,
+        'updated_at': updated,
+        'is_deleted': False,
+        'item_data': {
+            'name': name,
+            'reporting_category': {'id': 'CAT-CAKES' if 'Cake' in name or 'Sponge' in name else 'CAT-BAKES'},
+            'variations': [{
+                'type': 'ITEM_VARIATION',
+                'id': f"VAR-{index}" if size == 'Slice' else f"VAR-{index}-{size.upper()}",
+                'item_variation_data': {'name': size, 'price_money': {'amount': price, 'currency': 'GBP'}}
+            } for size, price in [('Slice', 350), ('Whole', 2400)]]
+        }
+    } for index, name in enumerate(ITEMS)]
+    return items + categories
+
+def make_order_event(order, event_type='order.created'):
+    """A webhook event body for order, shaped like Square's order.created / order.updated"""
+    object_key = event_type.replace('.', '_')
+    return {
+        'merchant_id': 'MFAKE',
+        'location_id': order['location_id'],
+        'type': event_type,
+        'event_id': f"{order['id']}-{event_type}-{order['updated_at']}",
+        'created_at': order['updated_at'],
+        'data': {
+            'type': object_key,
+            'id': order['id'],
+            'object': {object_key: {
+                'order_id': order['id'],
+                'location_id': order['location_id'],
+                'state': order['state'],
+                'created_at': order['created_at'],
+                'updated_at': order['updated_at'],
+                'version': 1
+            }}
+        }
+    }
+
+
+class FakeSquare:
+    """Data and fault settings shared by every request handler thread"""
+    def __init__(self, orders=None, rate_429=0.0, rate_5xx=0.0, latency=0.0, retry_after=None, seed=1):
+        self.orders = orders if orders is not None else make_orders(seed=seed)
+        self.payments = make_payments(self.orders)
+        self.catalog = make_catalog()
+        self.rate_429 = rate_429
+        self.rate_5xx = rate_5xx
+        self.latency = latency
+        self.retry_after = retry_after
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.stats = {'requests': 0, 'throttled': 0, 'errors': 0}
+
+    def fault(self):
+        """None, or the (status, headers) of a fault to inject for this request"""
+        with self.lock:
+            self.stats['requests'] += 1
+            roll = self.rng.random()
+            if roll < self.rate_429:
+                self.stats['throttled'] += 1
+                headers = {'Retry-After': str(self.retry_after)} if self.retry_after is not None else {}
+                return 429, headers
+            if roll < self.rate_429 + self.rate_5xx:
+                self.stats['errors'] += 1
+                return 503, {}
+        return None
+
+    def search_orders(self, body):
+        date_filter = body.get('query', {}).get('filter', {}).get('date_time_filter', {})
+        time_field = next(iter(date_filter), 'created_at')
+        bounds = date_filter.get(time_field, {})
+        start, end = bounds.get('start_at', ''), bounds.get('end_at', '~')
+
+        # Square filters are inclusive of start, exclusive of end; timestamps compare as strings
+        matches = sorted(
+            (order for order in self.orders if start <= order[time_field] < end),
+            key=lambda order: (order[time_field], order['id'])
+        )
+        return self._page(matches, 'orders', body.get('cursor'), body.get('limit', 500))
+
+    def batch_retrieve_orders(self, body):
+        wanted = set(body.get('order_ids', []))
+        return {'orders': [order for order in self.orders if order['id'] in wanted]}
+
+    def list_payments(self, params):
+        start, end = params.get('begin_time', ''), params.get('end_time', '~')
+        matches = [payment for payment in self.payments if start <= payment['created_at'] < end]
+        return self._page(matches, 'payments', params.get('cursor'), int(params.get('limit', 100)))
+
+    def update_catalog_object(self, object_id, **item_data):
+        """Change an object as if edited in Square: bump its version and updated_at"""
+        for obj in self.catalog:
+            if obj['id'] == object_id:
+                obj['item_data'].update(item_data)
+                obj['version'] += 1
+                obj['updated_at'] = _timestamp(datetime.utcnow())
+
+    def search_catalog(self, body):
+        types = set(body.get('object_types') or [])
+        begin_time = body.get('begin_time') or ''
+        matches = [
+            obj for obj in self.catalog
+            if (not types or obj['type'] in types) and obj['updated_at'] > begin_time
+            and (body.get('include_deleted_objects') or not obj.get('is_deleted'))
+        ]
+        page = self._page(matches, 'objects', body.get('cursor'), body.get('limit', 100))
+        page['latest_time'] = max(obj['updated_at'] for obj in self.catalog)
+        return page
+
+    def batch_retrieve_catalog(self, body):
+        wanted = set(body.get('object_ids', []))
+        return {'objects': [obj for obj in self.catalog if obj['id'] in wanted]}
+
+    @staticmethod
+    def _page(matches, key, cursor, limit):
+        offset = int(cursor or 0)
+        page = {key: matches[offset:offset + limit]}
+        if offset + limit < len(matches):
+            page['cursor'] = str(offset + limit)
+        return page
+
+
+class FakeSquareHandler(BaseHTTPRequestHandler):
+    fake = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, payload, headers=None):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _handle(self, route):
+        if self.fake.latency:
+            time.sleep(self.fake.latency * self.fake.rng.uniform(0.5, 1.5))
+
+        fault = self.fake.fault()
+        if fault:
+            status, headers = fault
+            code = 'RATE_LIMITED' if status == 429 else 'SERVICE_UNAVAILABLE'
+            self._send(status, {'errors': [{'category': 'RATE_LIMIT_ERROR' if status == 429 else 'API_ERROR', 'code': code}]}, headers)
+            return
+
+        try:
+            payload = route()
+        except KeyError:
+            self._send(404, {'errors': [{'category': 'INVALID_REQUEST_ERROR', 'code': 'NOT_FOUND'}]})
+            return
+        self._send(200, payload)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+        routes = {
+            '/v2/locations': lambda: {'locations': [{'id': LOCATION_ID, 'name': 'Fake Bakery'}]},
+            '/v2/payments': lambda: self.fake.list_payments(params),
+        }
+        self._handle(lambda: routes[url.path]())
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = json.loads(self.rfile.read(length) or b'{}')
+        routes = {
+            '/v2/orders/search': lambda: self.fake.search_orders(body),
+            '/v2/orders/batch-retrieve': lambda: self.fake.batch_retrieve_orders(body),
+            '/v2/catalog/search': lambda: self.fake.search_catalog(body),
+            '/v2/catalog/batch-retrieve': lambda: self.fake.batch_retrieve_catalog(body),
+        }
+        self._handle(lambda: routes[urlparse(self.path).path]())
+
+
+def start_fake_square(fake=None, port=0):
+    """Serve fake (a FakeSquare) on a background thread. Returns (server, base_url); call server.shutdown() when done."""
+    handler = type('Handler', (FakeSquareHandler,), {'fake': fake or FakeSquare()})
+    server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+def fake_square_api(base_url, backoff_base=0.05):
+    """A SquareAPI pointed at a fake server, with a short backoff so benchmarks finish quickly"""
+    import os
+    from square_api import SquareAPI
+
+    os.environ.update({'SQUARE_ACCESS_TOKEN': 'fake', 'SQUARE_LOCATION_ID': LOCATION_ID, 'SQUARE_BASE_URL': base_url})
+    square_api = SquareAPI()
+    square_api.backoff_base = backoff_base
+    return square_api
+
+def run_benchmark(days_back=90, shards=(1, 4)):
+    scenarios = [
+        ('clean', {}),
+        ('20ms latency', {'latency': 0.02}),
+        ('10% 429', {'rate_429': 0.1}),
+        ('10% 429 + Retry-After', {'rate_429': 0.1, 'retry_after': 1}),
+        ('10% 429 + 5% 503 + latency', {'rate_429': 0.1, 'rate_5xx': 0.05, 'latency': 0.02}),
+    ]
+    orders = make_orders()
+    expected = None
+
+    print(f"{'scenario':<30} {'shards':>6} {'seconds':>8} {'lines':>6} {'requests':>8} {'429s':>5} {'5xx':>5}  match")
+    for name, settings in scenarios:
+        for shard_count in shards:
+            fake = FakeSquare(orders=orders, **settings)
+            server, base_url = start_fake_square(fake)
+            try:
+                square_api = fake_square_api(base_url)
+                started = time.perf_counter()
+                lines = square_api.get_orders(days_back=days_back, shards=shard_count)
+                elapsed = time.perf_counter() - started
+            finally:
+                server.shutdown()
+
+            expected = expected if expected is not None else lines
+            stats = fake.stats
+            print(f"{name:<30} {shard_count:>6} {elapsed:>8.2f} {len(lines):>6} {stats['requests']:>8} "
+                  f"{stats['throttled']:>5} {stats['errors']:>5}  {'yes' if lines == expected else 'NO'}")
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Fake Square API server")
+    parser.add_argument('command', choices=['serve', 'bench'], nargs='?', default='serve')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--orders', type=int, default=1000)
+    parser.add_argument('--rate-429', type=float, default=0.0)
+    parser.add_argument('--rate-5xx', type=float, default=0.0)
+    parser.add_argument('--latency', type=float, default=0.0, help="seconds added to every response")
+    parser.add_argument('--retry-after', type=int, default=None, help="Retry-After seconds sent with 429s")
+    args = parser.parse_args()
+
+    if args.command == 'bench':
+        run_benchmark()
+    else:
+        fake = FakeSquare(
+            orders=make_orders(args.orders), rate_429=args.rate_429, rate_5xx=args.rate_5xx,
+            latency=args.latency, retry_after=args.retry_after
+        )
+        server, base_url = start_fake_square(fake, port=args.port)
+        print(f"Fake Square serving {len(fake.orders)} orders at {base_url} (location {LOCATION_ID})")
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            server.shutdown()
@@ -2,6 +2,7 @@ import streamlit as st
 from database import get_session, close_session
 from models import Ingredient, Supplier
 from datetime import datetime
+from utils import apply_stock_changes
 from styling import inject_custom_css, render_page_header
 
 def show_ingredients():
@@ -176,46 +177,50 @@ def show_ingredients():
                             st.rerun()
         
         with tab3:
+            import pandas as pd
+            
             st.subheader("Update Stock Levels")
             
-            ingredients = session.query(Ingredient).order_by(Ingredient.name).all()
+            stock = pd.DataFrame(
+                session.query(
+                    Ingredient.id,
+                    Ingredient.name,
+                    Ingredient.unit,
+                    Ingredient.current_stock
+                ).order_by(Ingredient.name).all(),
+                columns=['id', 'Ingredient', 'Unit', 'Stock']
+            ).set_index('id')
             
-            if ingredients:
-                with st.form("update_stock_form"):
-                    st.write("Adjust stock quantities (e.g., after receiving a delivery or taking inventory)")
-                    
-                    updates = {}
-                    
-                    for ingredient in ingredients:
-                        col1, col2, col3 = st.columns([2, 1, 1])
-                        
-                        with col1:
-                            st.write(f"**{ingredient.name}**")
-                        
-                        with col2:
-                            st.write(f"Current: {ingredient.current_stock:.2f} {ingredient.unit}")
-                        
-                        with col3:
-                            new_stock = st.number_input(
-                                f"New quantity",
-                                min_value=0.0,
-                                step=0.1,
-                                value=float(ingredient.current_stock),
-                                key=f"stock_{ingredient.id}",
-                                label_visibility="collapsed"
-                            )
-                            updates[ingredient.id] = new_stock
-                    
-                    if st.form_submit_button("💾 Update All Stock Levels"):
-                        for ingredient_id, new_stock in updates.items():
-                            ingredient = session.query(Ingredient).filter_by(id=ingredient_id).first()
-                            if ingredient:
-                                ingredient.current_stock = new_stock
-                                ingredient.last_updated = datetime.utcnow()
-                        
-                        session.commit()
-                        st.success("✅ Stock levels updated!")
-                        st.rerun()
+            if not stock.empty:
+                st.write("Adjust stock quantities (e.g., after receiving a delivery or taking inventory). Only changed rows are saved.")
+                
+                stock['Stock'] = stock['Stock'].fillna(0.0).astype(float)
+                
+                edited = st.data_editor(
+                    stock,
+                    column_config={
+                        'Ingredient': st.column_config.TextColumn(disabled=True),
+                        'Unit': st.column_config.TextColumn(disabled=True),
+                        'Stock': st.column_config.NumberColumn("New Stock", min_value=0.0, step=0.1, format="%.2f")
+                    },
+                    hide_index=True,
+                    use_container_width=True,
+                    key="stocktake_grid"
+                )
+                
+                changed = edited['Stock'].fillna(0.0) != stock['Stock']
+                st.caption(f"{int(changed.sum())} ingredient(s) changed")
+                
+                if st.button("💾 Save Stock Changes", disabled=not changed.any()):
+                    updated = apply_stock_changes(
+                        session,
+                        stock['Stock'].to_dict(),
+                        edited.loc[changed, 'Stock'].fillna(0.0).to_dict()
+                    )
+                    st.success(f"✅ Updated {updated} stock level(s)!")
+                    # Drop the editor's pending edits so it reloads from the saved levels
+                    del st.session_state["stocktake_grid"]
+                    st.rerun()
             else:
                 st.info("No ingredients available. Add ingredients first!")
         
@@ -2,13 +2,14 @@ import streamlit as st
 from styling import inject_custom_css, render_page_header
 from database import get_session, close_session
 from models import Ingredient, Supplier, SupplierOrder, SupplierOrderItem
-from utils import get_low_stock_ingredients, calculate_reorder_threshold
-import plotly.express as px
-import pandas as pd
-from pdf_reports import generate_inventory_report
+from utils import get_low_stock_ingredients
+from snapshot import get_snapshot
 from datetime import datetime, timedelta
 
 def show_inventory_alerts():
+    import pandas as pd
+    import plotly.express as px
+
     inject_custom_css()
 
     render_page_header("🔔 Inventory Alerts", "STAY STOCKED UP")
@@ -20,7 +21,8 @@ def show_inventory_alerts():
         
         st.info("📊 Reorder thresholds are automatically calculated based on your daily usage rate and supplier lead time, plus a 3-day safety buffer.")
         
-        low_stock = get_low_stock_ingredients(session)
+        stock_status = get_snapshot(session).stock
+        low_stock = get_low_stock_ingredients(session, stock_status)
         
         if low_stock:
             critical = [item for item in low_stock if item['urgency'] == 'critical']
@@ -174,28 +176,16 @@ def show_inventory_alerts():
         
         st.subheader("📊 Inventory Status Overview")
         
-        all_ingredients = session.query(Ingredient).all()
-        
-        if all_ingredients:
-            inventory_data = []
-            
-            for ing in all_ingredients:
-                reorder_point, daily_usage = calculate_reorder_threshold(session, ing)
-                days_remaining = ing.current_stock / daily_usage if daily_usage > 0 else 999
-                
-                stock_status = 'Critical' if days_remaining < 2 else 'Low' if days_remaining < 5 else 'Warning' if days_remaining < 10 else 'Good'
-                
-                inventory_data.append({
-                    'Ingredient': ing.name,
-                    'Current Stock': ing.current_stock,
-                    'Unit': ing.unit,
-                    'Daily Usage': daily_usage,
-                    'Days Remaining': min(days_remaining, 30),
-                    'Reorder Point': reorder_point,
-                    'Status': stock_status
-                })
-            
-            df = pd.DataFrame(inventory_data)
+        if not stock_status.empty:
+            df = pd.DataFrame({
+                'Ingredient': stock_status['name'],
+                'Current Stock': stock_status['current_stock'],
+                'Unit': stock_status['unit'],
+                'Daily Usage': stock_status['daily_usage'],
+                'Days Remaining': stock_status['days_remaining'].clip(upper=30),
+                'Reorder Point': stock_status['reorder_point'],
+                'Status': stock_status['status']
+            })
             
             if not df.empty:
                 status_colors = {
@@ -256,6 +246,7 @@ def show_inventory_alerts():
                         'supplier': ing.supplier
                     } for ing in ingredients])
                     
+                    from pdf_reports import generate_inventory_report
                     pdf_bytes = generate_inventory_report(ingredients_df, low_stock)
                     
                     st.download_button(
@@ -1,32 +1,18 @@
-import os
-from sqlalchemy import create_engine, text, inspect
+from sqlalchemy import create_engine
 from database import get_database_url
+from migrations import run_migrations, LATEST_VERSION
 
 def migrate_database():
+    """Kept for existing deploy scripts; the steps now live in migrations.py"""
     database_url = get_database_url()
     if not database_url:
         print("ERROR: DATABASE_URL not set")
         return False
     
     engine = create_engine(database_url)
-    inspector = inspect(engine)
+    applied = run_migrations(engine, verbose=True)
     
-    with engine.connect() as conn:
-        existing_tables = inspector.get_table_names()
-        
-        if 'ingredients' in existing_tables:
-            columns = [col['name'] for col in inspector.get_columns('ingredients')]
-            
-            if 'supplier_id' not in columns:
-                print("Adding supplier_id column to ingredients table...")
-                conn.execute(text("ALTER TABLE ingredients ADD COLUMN supplier_id INTEGER"))
-                conn.execute(text("ALTER TABLE ingredients ADD FOREIGN KEY (supplier_id) REFERENCES suppliers(id)"))
-                conn.commit()
-                print("✓ Added supplier_id column")
-            else:
-                print("✓ supplier_id column already exists")
-        
-        print("Database migration completed successfully!")
+    print(f"Database migration completed successfully! Schema version {LATEST_VERSION}, {len(applied)} migration(s) applied")
     
     return True
 
@@ -0,0 +1,174 @@
+"""
+Versioned schema migrations.
+
+Each migration runs once, in order, inside its own transaction, and is
+recorded in the schema_migrations table. A data migration may return a
+short note on what it did, which run_migrations prints when verbose. Steps are written to be safe on
+both Postgres and SQLite and on databases where create_all already built
+the latest schema.
+
+    python migrations.py status
+    python migrations.py upgrade
+"""
+from datetime import datetime
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.orm import Session
+from models import Base, SchemaMigration
+
+def add_column_if_missing(conn, table, column, column_type):
+    columns = [col['name'] for col in inspect(conn).get_columns(table)]
+    if column not in columns:
+        conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {column_type}"))
+
+def create_index_if_missing(conn, name, table, columns, unique=False):
+    unique_sql = "UNIQUE " if unique else ""
+    conn.execute(text(f"CREATE {unique_sql}INDEX IF NOT EXISTS {name} ON {table} ({', '.join(columns)})"))
+
+
+def _ingredient_supplier(conn):
+    add_column_if_missing(conn, 'ingredients', 'supplier_id', "INTEGER REFERENCES suppliers(id)")
+
+def _sales_line_identity(conn):
+    for column in ['order_id', 'line_uid', 'catalog_object_id']:
+        add_column_if_missing(conn, 'sales_cache', column, "VARCHAR(200)")
+    create_index_if_missing(conn, 'ix_sales_cache_order_line', 'sales_cache', ['order_id', 'line_uid'], unique=True)
+
+def _sales_recipe_id(conn):
+    add_column_if_missing(conn, 'sales_cache', 'recipe_id', "INTEGER REFERENCES recipes(id) ON DELETE SET NULL")
+    create_index_if_missing(conn, 'ix_sales_cache_recipe_id', 'sales_cache', ['recipe_id'])
+
+def _daily_usage_key(conn):
+    create_index_if_missing(conn, 'ix_daily_usage_ingredient_date', 'daily_usage', ['ingredient_id', 'date'], unique=True)
+
+def _sales_location(conn):
+    add_column_if_missing(conn, 'sales_cache', 'location_id', "VARCHAR(200)")
+
+def _hot_path_indexes(conn):
+    create_index_if_missing(conn, 'ix_sales_cache_timestamp', 'sales_cache', ['timestamp'])
+    create_index_if_missing(conn, 'ix_sales_cache_item_name', 'sales_cache', ['item_name'])
+    create_index_if_missing(conn, 'ix_profit_history_recipe_date', 'profit_history', ['recipe_id', 'date'])
+    create_index_if_missing(conn, 'ix_supplier_orders_supplier_id', 'supplier_orders', ['supplier_id'])
+    create_index_if_missing(conn, 'ix_supplier_orders_order_date', 'supplier_orders', ['order_date'])
+
+def _rebuild_sales_line_keys(conn):
+    """
+    Give SalesCache rows imported under the old "<order_id>_<item_name>" key
+    an (order_id, legacy-<id>) identity. No Square calls here: ingest_orders
+    swaps a legacy uid for the real line uid when the order is next fetched.
+    """
+    from models import SalesCache
+    from sales_ingest import build_sale_key, LEGACY_UID_PREFIX
+
+    session = Session(bind=conn)
+    rows = session.query(SalesCache).filter(SalesCache.line_uid.is_(None)).order_by(SalesCache.id).all()
+    if not rows:
+        return None
+
+    for row in rows:
+        row.order_id = row.order_id or (row.square_payment_id or '').split('_', 1)[0]
+        row.line_uid = f"{LEGACY_UID_PREFIX}{row.id}"
+        row.square_payment_id = build_sale_key(row.order_id, row.line_uid)
+
+    session.commit()
+    return f"rebuilt line keys for {len(rows)} sales rows"
+
+def _backfill_sales_derived_data(conn):
+    """Resolve recipe ids for existing sales, then rebuild usage and the daily rollup"""
+    from sales_ingest import backfill_recipe_ids, refresh_derived_tables
+
+    session = Session(bind=conn)
+    mapped = backfill_recipe_ids(session, refresh=False)
+    refresh_derived_tables(session)
+    return f"resolved recipe_id for {mapped} sales rows"
+
+def _recipe_costs(conn):
+    """Reverse ingredient -> recipe index and an initial fill of recipe_costs"""
+    from recipe_costing import recompute_recipe_costs
+
+    create_index_if_missing(conn, 'ix_recipe_items_ingredient_id', 'recipe_items', ['ingredient_id'])
+    session = Session(bind=conn)
+    recompute_recipe_costs(session)
+    session.commit()
+
+def _stock_adjustments(conn):
+    # The table itself comes from create_all
+    create_index_if_missing(conn, 'ix_stock_adjustments_ingredient_date', 'stock_adjustments', ['ingredient_id', 'created_at'])
+
+def _recipe_square_version(conn):
+    add_column_if_missing(conn, 'recipes', 'square_version', "BIGINT")
+
+
+MIGRATIONS = [
+    (1, 'ingredient supplier_id', _ingredient_supplier),
+    (2, 'sales_cache line identity', _sales_line_identity),
+    (3, 'sales_cache recipe_id', _sales_recipe_id),
+    (4, 'daily_usage (ingredient_id, date) key', _daily_usage_key),
+    (5, 'sales_cache location_id', _sales_location),
+    (6, 'hot-path indexes', _hot_path_indexes),
+    (7, 'rebuild sales line keys', _rebuild_sales_line_keys),
+    (8, 'backfill sales recipe ids and derived tables', _backfill_sales_derived_data),
+    (9, 'recipe_costs table and ingredient reverse index', _recipe_costs),
+    (10, 'stock_adjustments table', _stock_adjustments),
+    (11, 'recipes square_version', _recipe_square_version),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def get_schema_version(engine):
+    """Highest applied migration, or 0 for a database that has never been migrated"""
+    if not inspect(engine).has_table(SchemaMigration.__tablename__):
+        return 0
+    with engine.connect() as conn:
+        return conn.execute(text("SELECT MAX(version) FROM schema_migrations")).scalar() or 0
+
+def get_pending_migrations(engine):
+    version = get_schema_version(engine)
+    return [migration for migration in MIGRATIONS if migration[0] > version]
+
+def run_migrations(engine, verbose=False):
+    """Create missing tables, then apply pending migrations in order. Returns the versions applied."""
+    Base.metadata.create_all(engine)
+
+    applied = []
+    for version, name, migrate in get_pending_migrations(engine):
+        if verbose:
+            print(f"Applying {version}: {name}...")
+
+        with engine.begin() as conn:
+            note = migrate(conn)
+            conn.execute(
+                SchemaMigration.__table__.insert().values(version=version, name=name, applied_at=datetime.utcnow())
+            )
+
+        applied.append(version)
+        if verbose:
+            if note:
+                print(f"  {note}")
+            print(f"✓ {version}: {name}")
+
+    return applied
+
+if __name__ == "__main__":
+    import argparse
+    from database import get_database_url
+
+    parser = argparse.ArgumentParser(description="Ohh Crumbs schema migrations")
+    parser.add_argument('command', choices=['status', 'upgrade'], nargs='?', default='upgrade')
+    args = parser.parse_args()
+
+    database_url = get_database_url()
+    if not database_url:
+        print("ERROR: DATABASE_URL not set")
+        raise SystemExit(1)
+
+    engine = create_engine(database_url)
+
+    if args.command == 'status':
+        version = get_schema_version(engine)
+        print(f"Schema version: {version} (latest {LATEST_VERSION})")
+        for pending_version, name, _ in get_pending_migrations(engine):
+            print(f"  pending {pending_version}: {name}")
+    else:
+        applied = run_migrations(engine, verbose=True)
+        print(f"Database is at schema version {LATEST_VERSION} ({len(applied)} migration(s) applied)")
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, Text, Boolean
+from sqlalchemy import Column, Integer, BigInteger, String, Float, DateTime, ForeignKey, Text, Boolean, Index
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 from datetime import datetime
@@ -52,6 +52,8 @@ class Recipe(Base):
     id = Column(Integer, primary_key=True)
     name = Column(String(200), nullable=False, unique=True)
     square_item_id = Column(String(200))
+    # Square catalog object version last imported, to skip unchanged items
+    square_version = Column(BigInteger)
     sale_price = Column(Float, default=0.0)
     category = Column(String(100))
     description = Column(Text)
@@ -59,6 +61,7 @@ class Recipe(Base):
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
     recipe_items = relationship('RecipeItem', back_populates='recipe', cascade='all, delete-orphan')
+    aliases = relationship('RecipeAlias', back_populates='recipe', cascade='all, delete-orphan')
     
     def __repr__(self):
         return f"<Recipe(name='{self.name}', sale_price={self.sale_price})>"
@@ -66,6 +69,10 @@ class Recipe(Base):
 
 class RecipeItem(Base):
     __tablename__ = 'recipe_items'
+    __table_args__ = (
+        # Reverse index: which recipes use an ingredient
+        Index('ix_recipe_items_ingredient_id', 'ingredient_id'),
+    )
     
     id = Column(Integer, primary_key=True)
     recipe_id = Column(Integer, ForeignKey('recipes.id'), nullable=False)
@@ -79,11 +86,52 @@ class RecipeItem(Base):
         return f"<RecipeItem(recipe_id={self.recipe_id}, ingredient_id={self.ingredient_id}, quantity={self.quantity})>"
 
 
+class RecipeCost(Base):
+    __tablename__ = 'recipe_costs'
+    
+    recipe_id = Column(Integer, ForeignKey('recipes.id', ondelete='CASCADE'), primary_key=True)
+    cost = Column(Float, default=0.0)
+    sale_price = Column(Float, default=0.0)
+    profit = Column(Float, default=0.0)
+    margin = Column(Float, default=0.0)
+    previous_cost = Column(Float)
+    previous_margin = Column(Float)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+    margin_changed_at = Column(DateTime, index=True)
+    
+    def __repr__(self):
+        return f"<RecipeCost(recipe_id={self.recipe_id}, cost={self.cost}, margin={self.margin:.2f}%)>"
+
+
+class RecipeAlias(Base):
+    __tablename__ = 'recipe_aliases'
+    
+    id = Column(Integer, primary_key=True)
+    recipe_id = Column(Integer, ForeignKey('recipes.id'), nullable=False)
+    alias = Column(String(200), nullable=False, unique=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    
+    recipe = relationship('Recipe', back_populates='aliases')
+    
+    def __repr__(self):
+        return f"<RecipeAlias(alias='{self.alias}', recipe_id={self.recipe_id})>"
+
+
 class SalesCache(Base):
     __tablename__ = 'sales_cache'
+    __table_args__ = (
+        Index('ix_sales_cache_order_line', 'order_id', 'line_uid', unique=True),
+        Index('ix_sales_cache_timestamp', 'timestamp'),
+        Index('ix_sales_cache_item_name', 'item_name'),
+    )
     
     id = Column(Integer, primary_key=True)
     square_payment_id = Column(String(200), unique=True)
+    order_id = Column(String(200))
+    line_uid = Column(String(200))
+    catalog_object_id = Column(String(200))
+    location_id = Column(String(200))
+    recipe_id = Column(Integer, ForeignKey('recipes.id', ondelete='SET NULL'), index=True)
     item_name = Column(String(200))
     quantity = Column(Integer, default=1)
     total_amount = Column(Float)
@@ -94,6 +142,26 @@ class SalesCache(Base):
         return f"<SalesCache(item_name='{self.item_name}', quantity={self.quantity}, timestamp={self.timestamp})>"
 
 
+class SalesDaily(Base):
+    __tablename__ = 'sales_daily'
+    __table_args__ = (
+        Index('ix_sales_daily_key', 'business_date', 'item_name', 'location_id', unique=True),
+    )
+    
+    id = Column(Integer, primary_key=True)
+    business_date = Column(DateTime, nullable=False)
+    item_name = Column(String(200), nullable=False, default='')
+    location_id = Column(String(200), nullable=False, default='')
+    recipe_id = Column(Integer, ForeignKey('recipes.id', ondelete='SET NULL'), index=True)
+    units = Column(Integer, default=0)
+    gross_revenue = Column(Float, default=0.0)
+    cost = Column(Float, default=0.0)
+    transactions = Column(Integer, default=0)
+    
+    def __repr__(self):
+        return f"<SalesDaily(business_date={self.business_date}, item_name='{self.item_name}', units={self.units})>"
+
+
 class Settings(Base):
     __tablename__ = 'settings'
     
@@ -108,6 +176,9 @@ class Settings(Base):
 
 class DailyUsage(Base):
     __tablename__ = 'daily_usage'
+    __table_args__ = (
+        Index('ix_daily_usage_ingredient_date', 'ingredient_id', 'date', unique=True),
+    )
     
     id = Column(Integer, primary_key=True)
     ingredient_id = Column(Integer, ForeignKey('ingredients.id'), nullable=False)
@@ -118,8 +189,30 @@ class DailyUsage(Base):
         return f"<DailyUsage(ingredient_id={self.ingredient_id}, date={self.date}, quantity={self.quantity_used})>"
 
 
+class StockAdjustment(Base):
+    __tablename__ = 'stock_adjustments'
+    __table_args__ = (
+        Index('ix_stock_adjustments_ingredient_date', 'ingredient_id', 'created_at'),
+    )
+    
+    id = Column(Integer, primary_key=True)
+    ingredient_id = Column(Integer, ForeignKey('ingredients.id', ondelete='CASCADE'), nullable=False)
+    previous_stock = Column(Float, default=0.0)
+    new_stock = Column(Float, default=0.0)
+    change = Column(Float, default=0.0)
+    reason = Column(String(50), default='stocktake')
+    created_at = Column(DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f"<StockAdjustment(ingredient_id={self.ingredient_id}, change={self.change}, reason='{self.reason}')>"
+
+
 class SupplierOrder(Base):
     __tablename__ = 'supplier_orders'
+    __table_args__ = (
+        Index('ix_supplier_orders_supplier_id', 'supplier_id'),
+        Index('ix_supplier_orders_order_date', 'order_date'),
+    )
     
     id = Column(Integer, primary_key=True)
     supplier_id = Column(Integer, ForeignKey('suppliers.id'), nullable=False)
@@ -149,6 +242,7 @@ class SupplierOrderItem(Base):
     total_cost = Column(Float, default=0.0)
     
     order = relationship('SupplierOrder', back_populates='order_items')
+    ingredient = relationship('Ingredient')
     
     def __repr__(self):
         return f"<SupplierOrderItem(order_id={self.order_id}, ingredient_id={self.ingredient_id}, quantity={self.quantity})>"
@@ -156,6 +250,9 @@ class SupplierOrderItem(Base):
 
 class ProfitHistory(Base):
     __tablename__ = 'profit_history'
+    __table_args__ = (
+        Index('ix_profit_history_recipe_date', 'recipe_id', 'date'),
+    )
     
     id = Column(Integer, primary_key=True)
     recipe_id = Column(Integer, ForeignKey('recipes.id'), nullable=False)
@@ -168,3 +265,14 @@ class ProfitHistory(Base):
     
     def __repr__(self):
         return f"<ProfitHistory(recipe_id={self.recipe_id}, date={self.date}, profit_margin={self.profit_margin:.2f}%)>"
+
+
+class SchemaMigration(Base):
+    __tablename__ = 'schema_migrations'
+    
+    version = Column(Integer, primary_key=True, autoincrement=False)
+    name = Column(String(200), nullable=False)
+    applied_at = Column(DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f"<SchemaMigration(version={self.version}, name='{self.name}')>"
@@ -0,0 +1,69 @@
+"""
+Sidebar pages, imported only when selected so a cold start doesn't pay for
+plotly, pandas, the Square SDK etc. of pages nobody has opened yet.
+
+    python page_registry.py    # -X importtime report for every page
+"""
+import importlib
+import sys
+import time
+
+# (sidebar label, module, render function)
+PAGES = [
+    ("🏠 Dashboard", "dashboard", "show_dashboard"),
+    ("🥖 Ingredients", "ingredients", "show_ingredients"),
+    ("📖 Recipes", "recipes", "show_recipes"),
+    ("🔔 Inventory Alerts", "inventory_alerts", "show_inventory_alerts"),
+    ("💰 Profit Analysis", "profit_analysis", "show_profit_analysis"),
+    ("📦 Suppliers", "suppliers", "show_suppliers"),
+    ("🔗 Square Setup", "square_setup", "show_square_setup"),
+]
+
+# module -> seconds its first import took in this process
+IMPORT_TIMES = {}
+
+def page_labels():
+    return [label for label, _, _ in PAGES]
+
+def load_page(label):
+    """Import the page's module on first use and return (module, render function name)"""
+    for page_label, module_name, func in PAGES:
+        if page_label == label:
+            break
+    else:
+        raise KeyError(label)
+
+    if module_name not in sys.modules:
+        started = time.perf_counter()
+        importlib.import_module(module_name)
+        IMPORT_TIMES[module_name] = time.perf_counter() - started
+
+    return sys.modules[module_name], func
+
+def parse_importtime(stderr):
+    """Parse `python -X importtime` output into (module, self_us, cumulative_us) rows"""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, module = line[len('import time:'):].split('|', 2)
+        rows.append((module.strip(), int(self_us), int(cumulative_us)))
+    return rows
+
+def importtime_report(module_name, top=15):
+    """Import module_name in a fresh interpreter and return its slowest imports by cumulative time"""
+    import subprocess
+
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module_name}'],
+        capture_output=True, text=True
+    )
+    rows = parse_importtime(result.stderr)
+    return sorted(rows, key=lambda row: row[2], reverse=True)[:top]
+
+if __name__ == "__main__":
+    # database is what every request pays before a page is chosen
+    for module_name in ['database'] + [module for _, module, _ in PAGES]:
+        print(f"\n== {module_name}")
+        for module, self_us, cumulative_us in importtime_report(module_name):
+            print(f"{cumulative_us / 1000:9.1f} ms  {self_us / 1000:8.1f} ms self  {module}")
@@ -0,0 +1,206 @@
+"""
+Persisted recipe costs (the recipe_costs table).
+
+A before_commit hook recomputes only the recipes touched by the transaction:
+recipes whose price or items changed, and recipes that use an ingredient
+whose cost_per_unit changed (found through the recipe_items ingredient_id
+index). ORM flushes and bulk insert/update/delete statements are both
+tracked; a bulk statement whose rows can't be told from its parameters
+re-costs every recipe. Pages read the stored cost, profit and margin
+instead of re-costing every recipe.
+"""
+from datetime import datetime
+from sqlalchemy import event, func, inspect, select
+from sqlalchemy.orm import Session
+from models import Ingredient, Recipe, RecipeItem, RecipeCost
+
+MARGIN_TOLERANCE = 0.01
+
+def recipe_unit_costs(session):
+    """Subquery of (recipe_id, cost): ingredient cost of one unit of each recipe"""
+    return session.query(
+        RecipeItem.recipe_id.label('recipe_id'),
+        func.sum(RecipeItem.quantity * func.coalesce(Ingredient.cost_per_unit, 0.0)).label('cost')
+    ).join(Ingredient, Ingredient.id == RecipeItem.ingredient_id).group_by(RecipeItem.recipe_id).subquery()
+
+def get_recipes_using(session, ingredient_ids):
+    """Ids of recipes that use any of ingredient_ids"""
+    if not ingredient_ids:
+        return set()
+    return {
+        recipe_id for recipe_id, in session.query(RecipeItem.recipe_id).filter(
+            RecipeItem.ingredient_id.in_(list(ingredient_ids))
+        ).distinct()
+    }
+
+def recompute_recipe_costs(session, recipe_ids=None):
+    """
+    Re-cost recipe_ids (or every recipe) into recipe_costs. Does not commit.
+    Returns the recipes whose margin moved as a list of dicts.
+    """
+    item_costs = recipe_unit_costs(session)
+    query = session.query(
+        Recipe.id,
+        Recipe.name,
+        Recipe.sale_price,
+        func.coalesce(item_costs.c.cost, 0.0)
+    ).outerjoin(item_costs, item_costs.c.recipe_id == Recipe.id)
+
+    stored = session.query(RecipeCost)
+    if recipe_ids is not None:
+        if not recipe_ids:
+            return []
+        query = query.filter(Recipe.id.in_(list(recipe_ids)))
+        stored = stored.filter(RecipeCost.recipe_id.in_(list(recipe_ids)))
+
+    existing = {row.recipe_id: row for row in stored}
+    now = datetime.utcnow()
+    changes = []
+
+    for recipe_id, name, sale_price, cost in query.all():
+        sale_price = sale_price or 0.0
+        profit = sale_price - cost
+        margin = (profit / sale_price * 100) if sale_price > 0 else 0
+
+        row = existing.get(recipe_id)
+        if row is None:
+            session.add(RecipeCost(
+                recipe_id=recipe_id, cost=cost, sale_price=sale_price, profit=profit, margin=margin, updated_at=now
+            ))
+            continue
+
+        if row.cost == cost and row.sale_price == sale_price:
+            continue
+
+        if abs((row.margin or 0) - margin) >= MARGIN_TOLERANCE:
+            changes.append({
+                'recipe_id': recipe_id,
+                'name': name,
+                'old_cost': row.cost,
+                'new_cost': cost,
+                'old_margin': row.margin,
+                'new_margin': margin
+            })
+            row.previous_cost = row.cost
+            row.previous_margin = row.margin
+            row.margin_changed_at = now
+
+        row.cost = cost
+        row.sale_price = sale_price
+        row.profit = profit
+        row.margin = margin
+        row.updated_at = now
+
+    return changes
+
+def get_margin_changes(session, since):
+    """Recipes whose margin moved since the given time, biggest move first"""
+    rows = session.query(RecipeCost, Recipe.name).join(Recipe, Recipe.id == RecipeCost.recipe_id).filter(
+        RecipeCost.margin_changed_at >= since
+    ).all()
+
+    changes = [{
+        'recipe_id': row.recipe_id,
+        'name': name,
+        'old_cost': row.previous_cost,
+        'new_cost': row.cost,
+        'old_margin': row.previous_margin,
+        'new_margin': row.margin,
+        'changed_at': row.margin_changed_at
+    } for row, name in rows]
+
+    return sorted(changes, key=lambda change: abs(change['new_margin'] - (change['old_margin'] or 0)), reverse=True)
+
+
+def _pending(session):
+    return session.info.setdefault('recipe_cost_pending', {
+        'recipes': set(), 'ingredients': set(), 'deleted': set(), 'uncosted': False, 'all': False
+    })
+
+@event.listens_for(Session, 'after_flush')
+def _collect_cost_changes(session, flush_context):
+    pending = None
+
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, RecipeItem):
+            pending = pending or _pending(session)
+            pending['recipes'].add(obj.recipe_id)
+        elif isinstance(obj, Recipe):
+            pending = pending or _pending(session)
+            if obj in session.deleted:
+                pending['deleted'].add(obj.id)
+            elif obj in session.new or inspect(obj).attrs.sale_price.history.has_changes():
+                pending['recipes'].add(obj.id)
+        elif isinstance(obj, Ingredient) and obj not in session.new:
+            if inspect(obj).attrs.cost_per_unit.history.has_changes():
+                pending = pending or _pending(session)
+                pending['ingredients'].add(obj.id)
+
+@event.listens_for(Session, 'do_orm_execute')
+def _collect_bulk_cost_changes(orm_execute_state):
+    # Bulk INSERT/UPDATE/DELETE statements skip the flush, so read what they touch from their parameters
+    if not (orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete):
+        return
+    table = orm_execute_state.statement.table.name
+    if table not in (Recipe.__tablename__, RecipeItem.__tablename__, Ingredient.__tablename__):
+        return
+
+    rows = orm_execute_state.parameters or []
+    if isinstance(rows, dict):
+        rows = [rows]
+    # Only executemany-by-primary-key statements say which rows they write
+    by_key = bool(rows) and not orm_execute_state.is_delete and getattr(orm_execute_state.statement, 'whereclause', None) is None
+    pending = _pending(orm_execute_state.session)
+
+    if table == Ingredient.__tablename__:
+        # A new ingredient isn't used by any recipe yet
+        if orm_execute_state.is_insert:
+            return
+        if by_key and all('id' in row for row in rows):
+            pending['ingredients'].update(row['id'] for row in rows if 'cost_per_unit' in row)
+        else:
+            pending['all'] = True
+    elif table == Recipe.__tablename__:
+        if orm_execute_state.is_insert and by_key:
+            # New ids aren't known until the insert runs; cost whichever recipes have no cost row
+            pending['uncosted'] = True
+        elif by_key and all('id' in row for row in rows):
+            pending['recipes'].update(row['id'] for row in rows if 'sale_price' in row)
+        else:
+            pending['all'] = True
+    elif by_key and all('recipe_id' in row for row in rows):
+        pending['recipes'].update(row['recipe_id'] for row in rows)
+    else:
+        pending['all'] = True
+
+@event.listens_for(Session, 'before_commit')
+def _recompute_on_commit(session):
+    if session.info.get('recipe_cost_recomputing'):
+        return
+
+    # Flush first so the after_flush hook sees everything in this transaction
+    session.flush()
+    pending = session.info.pop('recipe_cost_pending', None)
+    if not pending:
+        return
+
+    session.info['recipe_cost_recomputing'] = True
+    try:
+        if pending['all']:
+            recipe_ids = None
+            session.query(RecipeCost).filter(RecipeCost.recipe_id.not_in(select(Recipe.id))).delete(synchronize_session=False)
+        else:
+            recipe_ids = (pending['recipes'] | get_recipes_using(session, pending['ingredients'])) - pending['deleted']
+            if pending['uncosted']:
+                recipe_ids |= {
+                    recipe_id for recipe_id, in session.query(Recipe.id).filter(
+                        Recipe.id.not_in(select(RecipeCost.recipe_id))
+                    )
+                }
+        if pending['deleted']:
+            session.query(RecipeCost).filter(RecipeCost.recipe_id.in_(list(pending['deleted']))).delete()
+        # Kept on the session so the page that saved a price can report what moved
+        session.info['recipe_cost_changes'] = recompute_recipe_costs(session, recipe_ids)
+        session.flush()
+    finally:
+        session.info.pop('recipe_cost_recomputing', None)
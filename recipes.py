@@ -1,7 +1,10 @@
 import streamlit as st
 from database import get_session, close_session
 from models import Recipe, Ingredient, RecipeItem
-from utils import calculate_recipe_cost, calculate_profit_margin
+from sqlalchemy.orm import selectinload
+from utils import calculate_recipe_costs
+from bom import get_bom
+from sales_ingest import backfill_recipe_ids
 from styling import inject_custom_css, render_page_header
 
 def show_recipes():
@@ -12,16 +15,20 @@ def show_recipes():
     session = get_session()
     
     try:
-        tab1, tab2 = st.tabs(["📋 View Recipes", "➕ Add Recipe"])
+        tab1, tab2, tab3 = st.tabs(["📋 View Recipes", "➕ Add Recipe", "🧮 Bake Planner"])
         
         with tab1:
             st.subheader("Current Recipes")
             
-            recipes = session.query(Recipe).order_by(Recipe.name).all()
+            recipes = session.query(Recipe).options(
+                selectinload(Recipe.recipe_items).selectinload(RecipeItem.ingredient)
+            ).order_by(Recipe.name).all()
             
             if recipes:
+                recipe_costs = calculate_recipe_costs(session)
+                
                 for recipe in recipes:
-                    cost, profit, margin = calculate_profit_margin(session, recipe.id)
+                    cost, profit, margin = recipe_costs[recipe.id]
                     
                     with st.expander(f"{recipe.name} - £{recipe.sale_price:.2f} | Margin: {margin:.1f}%"):
                         col1, col2 = st.columns(2)
@@ -225,8 +232,62 @@ def show_recipes():
                                     session.add(recipe_item)
                                 
                                 session.commit()
+                                
+                                # Pick up any earlier sales of this item that were unmapped
+                                backfill_recipe_ids(session)
                                 st.success(f"✅ Created recipe: {recipe_name}")
                                 st.rerun()
+        
+        with tab3:
+            import pandas as pd
+            
+            st.subheader("What Do I Need to Bake?")
+            st.write("Enter how many of each item you plan to bake to see the ingredients required against current stock.")
+            
+            recipes = session.query(Recipe).order_by(Recipe.name).all()
+            
+            if not recipes:
+                st.info("No recipes added yet. Create your first recipe in the 'Add Recipe' tab!")
+            else:
+                plan = st.data_editor(
+                    pd.DataFrame({'Recipe': [r.name for r in recipes], 'Units': [0] * len(recipes)}),
+                    disabled=['Recipe'],
+                    hide_index=True,
+                    use_container_width=True,
+                    key="bake_plan"
+                )
+                
+                quantities = {r.id: units for r, units in zip(recipes, plan['Units']) if units and units > 0}
+                
+                if quantities:
+                    demand = get_bom(session).plan(quantities)
+                    demand = demand[demand > 0]
+                    
+                    if demand.empty:
+                        st.info("The selected recipes don't have any ingredients yet.")
+                    else:
+                        ingredients = {
+                            ing.id: ing
+                            for ing in session.query(Ingredient).filter(Ingredient.id.in_(demand.index.tolist()))
+                        }
+                        
+                        needs = []
+                        for ingredient_id, needed in demand.items():
+                            ing = ingredients[ingredient_id]
+                            short_by = max(0.0, needed - ing.current_stock)
+                            needs.append({
+                                'Ingredient': ing.name,
+                                'Needed': f"{needed:.2f} {ing.unit}",
+                                'In Stock': f"{ing.current_stock:.2f} {ing.unit}",
+                                'Short By': f"{short_by:.2f} {ing.unit}" if short_by > 0 else "✅",
+                                'Cost': f"£{needed * ing.cost_per_unit:.2f}"
+                            })
+                        
+                        st.dataframe(pd.DataFrame(needs), use_container_width=True, hide_index=True)
+                        
+                        shortages = [n['Ingredient'] for n in needs if n['Short By'] != "✅"]
+                        if shortages:
+                            st.warning(f"⚠️ Not enough stock for: {', '.join(shortages)}")
     
     finally:
         close_session(session)
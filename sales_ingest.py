@@ -0,0 +1,387 @@
+from datetime import datetime, date, timedelta, timezone
+from sqlalchemy import insert, select, update, func, or_
+from models import SalesCache, Recipe, RecipeAlias
+from database import get_setting, set_setting, lock_setting
+from usage_accounting import update_usage_from_sales, rebuild_daily_usage
+from sales_rollup import update_sales_daily, rebuild_sales_daily
+
+CHUNK_SIZE = 500
+WATERMARK_KEY = 'square_sales_watermark:{location_id}'
+WATERMARK_OVERLAP = timedelta(minutes=5)
+# line_uid given to rows imported before line uids were stored (see migration 7)
+LEGACY_UID_PREFIX = 'legacy-'
+# Time shards fetched concurrently for the first (full window) sync
+BACKFILL_SHARDS = 4
+# Row locked while a batch of sales is inserted, so SalesCache ids commit in order
+INGEST_LOCK_KEY = 'sales_ingest_lock'
+
+def build_sale_key(order_id, line_uid):
+    """Legacy string key stored in SalesCache.square_payment_id, kept in step with (order_id, line_uid)"""
+    return f"{order_id}_{line_uid}"
+
+def _normalize_name(name):
+    return (name or '').strip().lower()
+
+def load_recipe_lookup(session):
+    """
+    Load everything needed to map a sale to a recipe in two queries: Square
+    catalog ids (Recipe.square_item_id and id aliases) and normalised names
+    (Recipe.name and name aliases).
+    """
+    by_square_id = {}
+    by_name = {}
+
+    for recipe_id, name, square_item_id in session.execute(
+        select(Recipe.id, Recipe.name, Recipe.square_item_id)
+    ):
+        if square_item_id:
+            by_square_id[square_item_id] = recipe_id
+        by_name[_normalize_name(name)] = recipe_id
+
+    # An alias may be a renamed/variant item name or a Square variation id
+    for recipe_id, alias in session.execute(select(RecipeAlias.recipe_id, RecipeAlias.alias)):
+        by_square_id.setdefault(alias, recipe_id)
+        by_name.setdefault(_normalize_name(alias), recipe_id)
+
+    return {'by_square_id': by_square_id, 'by_name': by_name}
+
+def resolve_recipe_id(lookup, catalog_object_id, item_name):
+    """Square catalog id first, then recipe name, then alias. Returns None for unmapped items."""
+    if catalog_object_id and catalog_object_id in lookup['by_square_id']:
+        return lookup['by_square_id'][catalog_object_id]
+    return lookup['by_name'].get(_normalize_name(item_name))
+
+def _order_to_row(order, lookup):
+    return {
+        'square_payment_id': build_sale_key(order['order_id'], order['line_uid']),
+        'order_id': order['order_id'],
+        'line_uid': order['line_uid'],
+        'catalog_object_id': order.get('catalog_object_id'),
+        'location_id': order.get('location_id'),
+        'recipe_id': resolve_recipe_id(lookup, order.get('catalog_object_id'), order['item_name']),
+        'item_name': order['item_name'],
+        'quantity': order['quantity'],
+        'total_amount': order['total_amount'],
+        'timestamp': datetime.fromisoformat(order['created_at'].replace('Z', '+00:00')),
+        'created_at': datetime.utcnow()
+    }
+
+def _insert_ignoring_duplicates(session, rows):
+    """Insert one chunk of rows, skipping keys that already exist. Returns the number inserted."""
+    dialect = session.get_bind().dialect.name
+
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert as pg_insert
+        stmt = pg_insert(SalesCache).values(rows).on_conflict_do_nothing(
+            index_elements=['order_id', 'line_uid']
+        )
+        return session.execute(stmt).rowcount
+
+    if dialect == 'sqlite':
+        stmt = insert(SalesCache).values(rows).prefix_with('OR IGNORE')
+        return session.execute(stmt).rowcount
+
+    # Other backends: one lookup per chunk instead of one per row
+    order_ids = {row['order_id'] for row in rows}
+    existing = set(session.execute(
+        select(SalesCache.order_id, SalesCache.line_uid).where(SalesCache.order_id.in_(order_ids))
+    ).tuples())
+    new_rows = [row for row in rows if (row['order_id'], row['line_uid']) not in existing]
+    if new_rows:
+        session.execute(insert(SalesCache), new_rows)
+    return len(new_rows)
+
+def _claim_legacy_rows(session, rows):
+    """
+    Rows migrated from the old item-name key carry a legacy-<id> line uid.
+    When real line items arrive for such an order, move each legacy row onto
+    a real (order_id, line_uid) with the same item name, in place, so the sale
+    isn't stored twice and the usage and rollup already counted for it stand.
+    Returns (rows still to insert, number of legacy rows claimed).
+    """
+    legacy = {}
+    for row_id, order_id, item_name in session.execute(
+        select(SalesCache.id, SalesCache.order_id, SalesCache.item_name).where(
+            SalesCache.order_id.in_({row['order_id'] for row in rows}),
+            SalesCache.line_uid.like(LEGACY_UID_PREFIX + '%')
+        ).order_by(SalesCache.id)
+    ):
+        legacy.setdefault((order_id, item_name), []).append(row_id)
+
+    if not legacy:
+        return rows, 0
+
+    claims = []
+    remaining = []
+    for row in rows:
+        candidates = legacy.get((row['order_id'], row['item_name']))
+        if candidates:
+            claims.append({
+                'id': candidates.pop(0),
+                'line_uid': row['line_uid'],
+                'square_payment_id': row['square_payment_id'],
+                'catalog_object_id': row['catalog_object_id']
+            })
+        else:
+            remaining.append(row)
+
+    if claims:
+        session.execute(update(SalesCache), claims)
+    return remaining, len(claims)
+
+def ingest_orders(session, orders, chunk_size=CHUNK_SIZE):
+    """
+    Write order line items from SquareAPI.get_orders into SalesCache in chunked
+    multi-row inserts. Lines of orders that aren't COMPLETED are left out.
+    Returns a dict with imported, skipped, not_completed and errors counts.
+    """
+    rows = []
+    errors = []
+    seen = set()
+    skipped = 0
+    not_completed = 0
+    lookup = load_recipe_lookup(session)
+
+    for order in orders:
+        # An order is still open (or was canceled) until Square marks it COMPLETED;
+        # a later sync or webhook picks it up once it is
+        if order.get('state') and order['state'] != 'COMPLETED':
+            not_completed += 1
+            continue
+
+        try:
+            row = _order_to_row(order, lookup)
+        except Exception as e:
+            errors.append({'order_id': order.get('order_id', 'unknown'), 'error': str(e)})
+            continue
+
+        # Duplicates inside the same fetch never reach the database
+        key = (row['order_id'], row['line_uid'])
+        if key in seen:
+            skipped += 1
+            continue
+        seen.add(key)
+        rows.append(row)
+
+    # update_usage_from_sales and update_sales_daily claim everything up to
+    # max(id). A sequence hands out ids before commit, so two ingests writing at
+    # once could commit out of id order and the later-committing, lower ids would
+    # land behind a watermark already moved past them. Taking this lock before
+    # the first insert makes ingests write and commit one at a time.
+    if rows:
+        lock_setting(session, INGEST_LOCK_KEY)
+
+    imported = 0
+    for start in range(0, len(rows), chunk_size):
+        chunk, claimed = _claim_legacy_rows(session, rows[start:start + chunk_size])
+        skipped += claimed
+        if not chunk:
+            continue
+        inserted = _insert_ignoring_duplicates(session, chunk)
+        imported += inserted
+        skipped += len(chunk) - inserted
+
+    session.commit()
+
+    if imported:
+        update_usage_from_sales(session)
+        update_sales_daily(session)
+
+    return {
+        'imported': imported,
+        'skipped': skipped,
+        'not_completed': not_completed,
+        'errors': errors,
+        'total_orders': len(orders)
+    }
+
+def _parse_square_time(value):
+    """Parse a Square RFC 3339 timestamp into a naive UTC datetime"""
+    parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if parsed.tzinfo:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+def get_sync_watermark(session, location_id):
+    """Return the last synced order updated_at for a location, or None before the first sync"""
+    value = get_setting(session, WATERMARK_KEY.format(location_id=location_id))
+    return datetime.fromisoformat(value) if value else None
+
+def set_sync_watermark(session, location_id, watermark):
+    set_setting(session, WATERMARK_KEY.format(location_id=location_id), watermark.isoformat())
+    session.commit()
+
+def _latest_update(orders):
+    updated_times = [_parse_square_time(order['updated_at']) for order in orders if order.get('updated_at')]
+    return max(updated_times) if updated_times else None
+
+def sync_square_sales(session, square_api, days_back=30):
+    """
+    Incrementally pull Square orders into SalesCache. The first run fetches the
+    last days_back days; later runs only fetch orders updated since the stored
+    watermark, minus a small overlap to cover late-arriving updates.
+
+    Orders are ingested and committed one Square page at a time, so a failure
+    part-way keeps the pages already written. Incremental pages arrive in
+    updated_at order and move the watermark as they commit; the first run's
+    pages are in created_at order, so its watermark is only stored at the end.
+    """
+    watermark = get_sync_watermark(session, square_api.location_id)
+
+    if watermark:
+        pages = square_api.iter_orders(updated_since=watermark - WATERMARK_OVERLAP)
+    else:
+        pages = square_api.iter_orders(days_back=days_back, shards=BACKFILL_SHARDS)
+
+    totals = {'imported': 0, 'skipped': 0, 'not_completed': 0, 'errors': [], 'total_orders': 0}
+    latest = watermark
+
+    for orders in pages:
+        result = ingest_orders(session, orders)
+        totals['imported'] += result['imported']
+        totals['skipped'] += result['skipped']
+        totals['not_completed'] += result['not_completed']
+        totals['errors'].extend(result['errors'])
+        totals['total_orders'] += result['total_orders']
+
+        page_latest = _latest_update(orders)
+        if page_latest and (not latest or page_latest > latest):
+            latest = page_latest
+            if watermark:
+                set_sync_watermark(session, square_api.location_id, latest)
+
+    if not watermark and latest:
+        set_sync_watermark(session, square_api.location_id, latest)
+
+    return totals
+
+def backfill_recipe_ids(session, only_unmapped=True, refresh=True):
+    """
+    Resolve SalesCache.recipe_id for existing rows. Rows are grouped by
+    (catalog id, item name) so each distinct item costs one UPDATE, not one per sale.
+    With refresh, usage and the rollup are then rebuilt for the remapped items only.
+    Returns the number of rows mapped.
+    """
+    lookup = load_recipe_lookup(session)
+
+    query = select(SalesCache.catalog_object_id, SalesCache.item_name).group_by(
+        SalesCache.catalog_object_id, SalesCache.item_name
+    )
+    if only_unmapped:
+        query = query.where(SalesCache.recipe_id.is_(None))
+
+    mapped = 0
+    remapped_names = set()
+    for catalog_object_id, item_name in session.execute(query).all():
+        recipe_id = resolve_recipe_id(lookup, catalog_object_id, item_name)
+        if recipe_id is None and only_unmapped:
+            continue
+
+        stmt = update(SalesCache).where(
+            SalesCache.item_name == item_name,
+            SalesCache.catalog_object_id.is_(None) if catalog_object_id is None
+            else SalesCache.catalog_object_id == catalog_object_id,
+            # Only rows whose recipe actually changes
+            or_(SalesCache.recipe_id.is_(None), SalesCache.recipe_id != recipe_id) if recipe_id is not None
+            else SalesCache.recipe_id.isnot(None)
+        ).values(recipe_id=recipe_id)
+        if only_unmapped:
+            stmt = stmt.where(SalesCache.recipe_id.is_(None))
+        changed = session.execute(stmt).rowcount
+        if changed:
+            mapped += changed
+            remapped_names.add(item_name)
+
+    session.commit()
+
+    if refresh and remapped_names:
+        refresh_derived_tables(session, remapped_names)
+    return mapped
+
+def get_unmapped_items(session):
+    """Sales that don't resolve to any recipe, one row per item name"""
+    rows = session.execute(
+        select(
+            SalesCache.item_name,
+            func.max(SalesCache.catalog_object_id),
+            func.count(SalesCache.id),
+            func.sum(SalesCache.quantity),
+            func.sum(SalesCache.total_amount),
+            func.max(SalesCache.timestamp)
+        ).where(SalesCache.recipe_id.is_(None)).group_by(SalesCache.item_name)
+        .order_by(func.sum(SalesCache.quantity).desc())
+    ).all()
+
+    return [{
+        'item_name': item_name,
+        'catalog_object_id': catalog_object_id,
+        'sales': sales,
+        'units_sold': units or 0,
+        'revenue': revenue or 0.0,
+        'last_sold': last_sold
+    } for item_name, catalog_object_id, sales, units, revenue, last_sold in rows]
+
+def refresh_derived_tables(session, item_names=None):
+    """
+    Rebuild usage and the daily rollup after existing sales change recipe.
+    With item_names, only the days those items sold on (usage) and their own
+    rollup rows are rebuilt, so every other row keeps its cost at time of sale.
+    """
+    if item_names is None:
+        rebuild_daily_usage(session)
+        rebuild_sales_daily(session)
+        return
+
+    first_sale, last_sale = session.query(func.min(SalesCache.timestamp), func.max(SalesCache.timestamp)).filter(
+        func.coalesce(SalesCache.item_name, '').in_([name or '' for name in item_names])
+    ).one()
+    if first_sale is None:
+        return
+
+    rebuild_daily_usage(session, start_date=first_sale, end_date=last_sale)
+    rebuild_sales_daily(session, item_names=item_names)
+
+def add_recipe_alias(session, recipe_id, alias):
+    """Map an item name or Square catalog id to a recipe and re-resolve unmapped sales"""
+    existing = session.query(RecipeAlias).filter_by(alias=alias).first()
+    if existing:
+        existing.recipe_id = recipe_id
+    else:
+        session.add(RecipeAlias(recipe_id=recipe_id, alias=alias))
+    session.commit()
+    return backfill_recipe_ids(session)
+
+if __name__ == "__main__":
+    import argparse
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import Session
+    from database import get_database_url
+
+    parser = argparse.ArgumentParser(description="Square sales ingestion maintenance")
+    subcommands = parser.add_subparsers(dest='command', required=True)
+    backfill = subcommands.add_parser('backfill-recipes', help="Resolve recipe_id for existing sales")
+    backfill.add_argument('--all', action='store_true', help="Re-resolve every row, not just unmapped ones")
+    usage = subcommands.add_parser('rebuild-usage', help="Recompute DailyUsage from sales (all history by default)")
+    usage.add_argument('--start', type=date.fromisoformat, help="First day to rebuild (YYYY-MM-DD)")
+    usage.add_argument('--end', type=date.fromisoformat, help="Last day to rebuild (YYYY-MM-DD)")
+    subcommands.add_parser('rebuild-rollup', help="Recompute the sales_daily rollup from raw sales")
+    args = parser.parse_args()
+
+    database_url = get_database_url()
+    if not database_url:
+        print("ERROR: DATABASE_URL not set")
+        raise SystemExit(1)
+
+    with Session(create_engine(database_url)) as session:
+        if args.command == 'backfill-recipes':
+            mapped = backfill_recipe_ids(session, only_unmapped=not args.all)
+            print(f"✓ Resolved recipe_id for {mapped} sales rows")
+            print(f"{len(get_unmapped_items(session))} item name(s) still unmapped")
+        elif args.command == 'rebuild-usage':
+            written = rebuild_daily_usage(session, start_date=args.start, end_date=args.end)
+            print(f"✓ Rebuilt {written} daily usage rows")
+            # Pick up anything ingested after the rebuilt range
+            update_usage_from_sales(session)
+        elif args.command == 'rebuild-rollup':
+            written = rebuild_sales_daily(session)
+            print(f"✓ Rebuilt {written} sales_daily rows")
@@ -0,0 +1,138 @@
+from sqlalchemy import func, select, delete
+from models import SalesCache, SalesDaily, Settings
+from database import get_setting, set_setting, compare_and_set_setting, upsert_increment
+from usage_accounting import as_day
+from recipe_costing import recipe_unit_costs
+
+ROLLUP_WATERMARK_KEY = 'sales_daily_last_sales_id'
+
+def _get_rollup_watermark(session):
+    value = get_setting(session, ROLLUP_WATERMARK_KEY)
+    return int(value) if value else 0
+
+def _aggregate_sales(session, *filters):
+    """
+    Group raw sales into (business date, item, location) rows. Cost is the
+    recipe's unit cost when the rollup runs, i.e. at time of ingestion.
+    """
+    day = func.date(SalesCache.timestamp)
+    item_name = func.coalesce(SalesCache.item_name, '')
+    location_id = func.coalesce(SalesCache.location_id, '')
+    unit_costs = recipe_unit_costs(session)
+
+    rows = session.execute(
+        select(
+            day,
+            item_name,
+            location_id,
+            func.max(SalesCache.recipe_id),
+            func.coalesce(func.sum(SalesCache.quantity), 0),
+            func.coalesce(func.sum(SalesCache.total_amount), 0.0),
+            func.coalesce(func.sum(SalesCache.quantity * unit_costs.c.cost), 0.0),
+            func.count(SalesCache.id)
+        ).outerjoin(
+            unit_costs, unit_costs.c.recipe_id == SalesCache.recipe_id
+        ).where(*filters).group_by(day, item_name, location_id)
+    ).all()
+
+    return [{
+        'business_date': as_day(sale_day),
+        'item_name': name,
+        'location_id': location,
+        'recipe_id': recipe_id,
+        'units': units,
+        'gross_revenue': revenue,
+        'cost': cost,
+        'transactions': transactions
+    } for sale_day, name, location, recipe_id, units, revenue, cost, transactions in rows]
+
+def _add_to_rollup(session, rows):
+    upsert_increment(
+        session,
+        SalesDaily,
+        rows,
+        ['business_date', 'item_name', 'location_id'],
+        ['units', 'gross_revenue', 'cost', 'transactions']
+    )
+
+def update_sales_daily(session):
+    """
+    Incremental stage run after each sales ingestion: fold SalesCache rows newer
+    than the stored id watermark into sales_daily. As in update_usage_from_sales,
+    the id range is claimed with a compare-and-set on the watermark first, so
+    concurrent ingests can't both add it, and ingest_orders' lock keeps sales
+    committing in id order so none fall behind it. Returns the number of rollup
+    rows touched.
+    """
+    while True:
+        watermark = session.execute(select(Settings.value).where(Settings.key == ROLLUP_WATERMARK_KEY)).scalar()
+        last_id = int(watermark) if watermark else 0
+        max_id = session.query(func.max(SalesCache.id)).scalar() or 0
+
+        if max_id <= last_id:
+            return 0
+
+        if compare_and_set_setting(session, ROLLUP_WATERMARK_KEY, watermark, str(max_id)):
+            break
+        session.rollback()
+
+    rows = _aggregate_sales(session, SalesCache.id > last_id, SalesCache.id <= max_id)
+    if rows:
+        _add_to_rollup(session, rows)
+
+    session.commit()
+    return len(rows)
+
+def rebuild_sales_daily(session, item_names=None):
+    """
+    Recompute sales_daily from raw sales, e.g. after sales are remapped to
+    recipes. Rebuilt rows are re-priced at current ingredient costs, so pass
+    item_names to rebuild only those items' rows and keep the cost stored at
+    ingestion everywhere else; with item_names the watermark doesn't move.
+    """
+    if item_names is not None:
+        item_names = [name or '' for name in item_names]
+        last_id = _get_rollup_watermark(session)
+
+        session.execute(delete(SalesDaily).where(SalesDaily.item_name.in_(item_names)))
+        rows = _aggregate_sales(
+            session,
+            SalesCache.id <= last_id,
+            func.coalesce(SalesCache.item_name, '').in_(item_names)
+        )
+        if rows:
+            _add_to_rollup(session, rows)
+
+        session.commit()
+        return len(rows)
+
+    max_id = session.query(func.max(SalesCache.id)).scalar() or 0
+
+    session.execute(delete(SalesDaily))
+    rows = _aggregate_sales(session, SalesCache.id <= max_id)
+    if rows:
+        _add_to_rollup(session, rows)
+
+    set_setting(session, ROLLUP_WATERMARK_KEY, str(max_id))
+    session.commit()
+    return len(rows)
+
+def get_daily_totals(session, start_date):
+    """Revenue and units per business date since start_date"""
+    return session.query(
+        SalesDaily.business_date,
+        func.sum(SalesDaily.gross_revenue),
+        func.sum(SalesDaily.units)
+    ).filter(
+        SalesDaily.business_date >= as_day(start_date)
+    ).group_by(SalesDaily.business_date).order_by(SalesDaily.business_date).all()
+
+def get_top_items(session, start_date, limit=10):
+    """Best sellers by units since start_date as (item_name, units, revenue)"""
+    return session.query(
+        SalesDaily.item_name,
+        func.sum(SalesDaily.units),
+        func.sum(SalesDaily.gross_revenue)
+    ).filter(
+        SalesDaily.business_date >= as_day(start_date)
+    ).group_by(SalesDaily.item_name).order_by(func.sum(SalesDaily.units).desc()).limit(limit).all()
@@ -0,0 +1,142 @@
+"""
+BakerySnapshot: the derived analytics shared by every page, built once per
+data version instead of once per section that needs them.
+"""
+from datetime import datetime, timedelta
+from sqlalchemy import func
+from models import Recipe, SalesDaily
+from data_versions import cached_on
+
+class BakerySnapshot:
+    """
+    recipes: one row per recipe with cost, profit, margin and all-time units sold
+    sales: sales_daily rolled up per (business_date, recipe_id), at the cost stored when each sale was rolled up
+    stock: get_stock_status() frame, one row per ingredient
+    """
+    def __init__(self, recipes, sales, stock):
+        self.recipes = recipes
+        self.sales = sales
+        self.stock = stock
+
+    def copy(self):
+        """Copy of the frames, so get_snapshot callers can't change the cached snapshot"""
+        return BakerySnapshot(self.recipes.copy(), self.sales.copy(), self.stock.copy())
+
+    def sales_summary(self, days=30):
+        import pandas as pd
+
+        start = pd.Timestamp((datetime.utcnow() - timedelta(days=days)).date())
+        window = self.sales[self.sales['business_date'] >= start]
+
+        total_revenue = float(window['revenue'].sum())
+        total_cost = float(window['cost'].sum())
+        total_profit = total_revenue - total_cost
+
+        return {
+            'total_revenue': total_revenue,
+            'total_cost': total_cost,
+            'total_profit': total_profit,
+            'avg_profit_margin': (total_profit / total_revenue * 100) if total_revenue > 0 else 0,
+            'total_items_sold': int(window['units'].sum()),
+            'num_transactions': int(window['transactions'].sum())
+        }
+
+    @property
+    def low_stock(self):
+        return self.stock[self.stock['is_low']].sort_values('days_remaining', kind='stable')
+
+    def recommendations(self):
+        recommendations = []
+        df = self.recipes
+
+        if not df.empty:
+            high_margin_items = df[df['margin'] > 60].sort_values('margin', ascending=False)
+            if not high_margin_items.empty:
+                top_item = high_margin_items.iloc[0]
+                recommendations.append({
+                    'type': 'promote',
+                    'priority': 'high',
+                    'message': f"🌟 '{top_item['name']}' has a {top_item['margin']:.1f}% profit margin. Consider promoting it more heavily."
+                })
+
+            low_margin_items = df[df['margin'] < 20].sort_values('units_sold', ascending=False)
+            if not low_margin_items.empty:
+                top_low = low_margin_items.iloc[0]
+                recommendations.append({
+                    'type': 'optimize',
+                    'priority': 'medium',
+                    'message': f"⚠️ '{top_low['name']}' has only {top_low['margin']:.1f}% margin. Consider raising prices or reducing ingredient costs."
+                })
+
+            best_profit = df.sort_values('total_profit', ascending=False).iloc[0]
+            best_sales = df.sort_values('units_sold', ascending=False).iloc[0]
+
+            if best_profit['name'] != best_sales['name']:
+                recommendations.append({
+                    'type': 'insight',
+                    'priority': 'medium',
+                    'message': f"💡 '{best_sales['name']}' sells best, but '{best_profit['name']}' generates more total profit. Balance your menu accordingly."
+                })
+
+        critical = self.low_stock[self.low_stock['urgency'] == 'critical']
+        if not critical.empty:
+            ingredient_names = ', '.join(critical['name'].head(3))
+            recommendations.append({
+                'type': 'urgent',
+                'priority': 'critical',
+                'message': f"🚨 URGENT: Low stock on {ingredient_names}. Order immediately!"
+            })
+
+        return recommendations
+
+
+def _load_recipes(session, sales):
+    import pandas as pd
+    from utils import calculate_recipe_costs
+
+    recipes = pd.DataFrame(
+        session.query(Recipe.id, Recipe.name, Recipe.sale_price).order_by(Recipe.id).all(),
+        columns=['recipe_id', 'name', 'sale_price']
+    )
+    costs = pd.DataFrame.from_dict(calculate_recipe_costs(session), orient='index', columns=['cost', 'profit', 'margin'])
+    units = sales.groupby('recipe_id')['units'].sum()
+
+    recipes['sale_price'] = recipes['sale_price'].fillna(0.0)
+    recipes = recipes.join(costs, on='recipe_id')
+    recipes[['cost', 'profit', 'margin']] = recipes[['cost', 'profit', 'margin']].fillna(0.0)
+    recipes['units_sold'] = recipes['recipe_id'].map(units).fillna(0).astype(int)
+    recipes['total_revenue'] = recipes['sale_price'] * recipes['units_sold']
+    recipes['total_profit'] = recipes['profit'] * recipes['units_sold']
+    return recipes
+
+def _load_sales(session):
+    import pandas as pd
+
+    sales = pd.DataFrame(
+        session.query(
+            SalesDaily.business_date,
+            SalesDaily.recipe_id,
+            func.sum(SalesDaily.units),
+            func.sum(SalesDaily.gross_revenue),
+            func.sum(SalesDaily.transactions),
+            # Cost at time of sale, so past profit doesn't move when an ingredient price does
+            func.coalesce(func.sum(SalesDaily.cost), 0.0)
+        ).group_by(SalesDaily.business_date, SalesDaily.recipe_id).all(),
+        columns=['business_date', 'recipe_id', 'units', 'revenue', 'transactions', 'cost']
+    )
+    sales['business_date'] = pd.to_datetime(sales['business_date'])
+    for column in ['units', 'revenue', 'transactions', 'cost']:
+        sales[column] = sales[column].fillna(0)
+    return sales
+
+@cached_on('recipes', 'recipe_costs', 'sales_daily', 'ingredients', 'daily_usage')
+def get_snapshot(session):
+    """The current BakerySnapshot; rebuilt only after one of its source tables changes"""
+    from utils import get_stock_status
+
+    sales = _load_sales(session)
+    return BakerySnapshot(
+        recipes=_load_recipes(session, sales),
+        sales=sales,
+        stock=get_stock_status(session)
+    )
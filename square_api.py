@@ -1,9 +1,57 @@
 import os
+import queue
+import random
+import threading
+import time
+import httpx
+from concurrent.futures import ThreadPoolExecutor
 from square import Square
 from square.core.api_error import ApiError
 from datetime import datetime, timedelta
 import streamlit as st
 
+# Pages each fetch worker may get ahead of the consumer
+PREFETCH_PAGES = 2
+
+# Throttled (429) and transient (5xx, network) failures are retried per
+# request, so one bad page is re-requested at its own cursor instead of
+# failing or restarting the whole fetch
+MAX_RETRIES = 5
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 30.0
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+# The SDK's own retries (2, without jitter) would multiply ours
+NO_SDK_RETRIES = {'max_retries': 0}
+
+def _retry_after(error):
+    """Seconds from a Retry-After header on an ApiError, or None"""
+    headers = {key.lower(): value for key, value in (getattr(error, 'headers', None) or {}).items()}
+    try:
+        return max(0.0, float(headers['retry-after']))
+    except (KeyError, TypeError, ValueError):
+        return None
+
+def is_retryable(error):
+    if isinstance(error, ApiError):
+        return error.status_code in RETRYABLE_STATUS
+    return isinstance(error, httpx.TransportError)
+
+def backoff_delay(attempt, error=None, base=BACKOFF_BASE):
+    """
+    Seconds to wait before retry number attempt (0-based): Square's
+    Retry-After when it sends one, otherwise exponential backoff with full jitter
+    """
+    retry_after = _retry_after(error)
+    if retry_after is not None:
+        return min(retry_after, BACKOFF_MAX)
+    return random.uniform(0, min(BACKOFF_MAX, base * 2 ** attempt))
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def _category_names(_square_api, category_ids):
+    result = _square_api._request(_square_api.client.catalog.batch_get, object_ids=list(category_ids))
+    objects = result.objects if hasattr(result, 'objects') and result.objects else []
+    return {obj.id: obj.category_data.name for obj in objects if getattr(obj, 'category_data', None)}
+
 class SquareAPI:
     def __init__(self):
         self.access_token = os.getenv('SQUARE_ACCESS_TOKEN')
@@ -14,94 +62,182 @@ class SquareAPI:
             self.is_configured = False
         else:
             self.client = Square(
-                token=self.access_token
+                token=self.access_token,
+                # Point at a local fake_square.py server for offline testing
+                base_url=os.getenv('SQUARE_BASE_URL') or None
             )
             self.is_configured = True
 
+        self.max_retries = MAX_RETRIES
+        self.backoff_base = BACKOFF_BASE
+
+    def _request(self, call, **params):
+        """Call a Square endpoint, retrying throttled and transient failures up to max_retries times"""
+        for attempt in range(self.max_retries + 1):
+            try:
+                return call(**params, request_options=NO_SDK_RETRIES)
+            except Exception as e:
+                if attempt == self.max_retries or not is_retryable(e):
+                    raise
+                time.sleep(backoff_delay(attempt, e, base=self.backoff_base))
+
     def test_connection(self):
         if not self.is_configured:
             return False, "Square API credentials not configured"
 
         try:
-            result = self.client.locations.list()
+            result = self._request(self.client.locations.list)
             return True, "Connected successfully"
         except ApiError as e:
             return False, f"API Error: {str(e)}"
         except Exception as e:
             return False, str(e)
 
-    def get_catalog_items(self):
+    def _catalog_item(self, obj):
+        """Flatten a Square ITEM into one dict, with its variations (id, price) in Square's order"""
+        item_data = obj.item_data if hasattr(obj, 'item_data') and obj.item_data else None
+        variations = []
+
+        for variation in (item_data.variations or []) if item_data else []:
+            variation_data = variation.item_variation_data if hasattr(variation, 'item_variation_data') else None
+            price_money = variation_data.price_money if variation_data and hasattr(variation_data, 'price_money') else None
+            variations.append({
+                'id': variation.id if hasattr(variation, 'id') else '',
+                'price': (price_money.amount / 100.0) if price_money and price_money.amount is not None else 0
+            })
+
+        # category_id is deprecated in favour of categories / reporting_category
+        category_id = None
+        if item_data:
+            if getattr(item_data, 'reporting_category', None):
+                category_id = item_data.reporting_category.id
+            elif getattr(item_data, 'category_id', None):
+                category_id = item_data.category_id
+            elif getattr(item_data, 'categories', None):
+                category_id = item_data.categories[0].id
+
+        return {
+            'id': obj.id,
+            'version': obj.version if hasattr(obj, 'version') else None,
+            'is_deleted': bool(getattr(obj, 'is_deleted', False)),
+            'name': item_data.name if item_data and item_data.name else 'Unknown',
+            'category_id': category_id,
+            # The first variation is the item's default price
+            'price': variations[0]['price'] if variations else 0,
+            'variations': variations
+        }
+
+    def search_catalog_items(self, begin_time=None):
+        """
+        Catalog ITEMs changed since begin_time (Square RFC 3339 timestamp), or
+        the whole catalog when it is None, deleted items included. Returns
+        (items, latest_time); pass latest_time as the next call's begin_time.
+        """
         if not self.is_configured:
-            return []
+            return [], None
 
         try:
             items = []
+            latest_time = None
             cursor = None
 
             while True:
-                result = self.client.catalog.list(types='ITEM', cursor=cursor)
-
-                objects = result.objects if hasattr(result, 'objects') else []
-                for obj in objects:
-                    item_data = obj.item_data if hasattr(obj, 'item_data') else {}
-                    variations = item_data.variations if hasattr(item_data, 'variations') else []
-
-                    for variation in variations:
-                        variation_data = variation.item_variation_data if hasattr(variation, 'item_variation_data') else None
-                        if variation_data:
-                            price_money = variation_data.price_money if hasattr(variation_data, 'price_money') else None
-                            price = (price_money.amount / 100.0) if price_money and hasattr(price_money, 'amount') else 0
-
-                            items.append({
-                                'id': obj.id if hasattr(obj, 'id') else '',
-                                'name': item_data.name if hasattr(item_data, 'name') else 'Unknown',
-                                'variation_id': variation.id if hasattr(variation, 'id') else '',
-                                'price': price,
-                                'category': item_data.category_id if hasattr(item_data, 'category_id') else 'Uncategorized'
-                            })
+                search_params = {
+                    'object_types': ['ITEM'],
+                    'include_deleted_objects': True,
+                    'limit': 1000
+                }
+                if begin_time:
+                    search_params['begin_time'] = begin_time
+                if cursor:
+                    search_params['cursor'] = cursor
+
+                result = self._request(self.client.catalog.search, **search_params)
+
+                # Every page reports the same catalog time; keep the first
+                latest_time = latest_time or (result.latest_time if hasattr(result, 'latest_time') else None)
+                objects = result.objects if hasattr(result, 'objects') and result.objects else []
+                items.extend(self._catalog_item(obj) for obj in objects)
 
                 cursor = result.cursor if hasattr(result, 'cursor') else None
                 if not cursor:
                     break
 
-            return items
+            return items, latest_time
 
         except ApiError as e:
             st.error(f"Square API error fetching catalog: {str(e)}")
-            return []
+            return [], None
         except Exception as e:
             st.error(f"Exception fetching catalog: {str(e)}")
-            return []
+            return [], None
 
-    def get_payments(self, days_back=30):
-        if not self.is_configured or not self.location_id:
-            return []
+    def get_category_names(self, category_ids):
+        """{category id: name} for category_ids, fetched in one batch request and cached for an hour"""
+        category_ids = tuple(sorted({category_id for category_id in category_ids if category_id}))
+        if not self.is_configured or not category_ids:
+            return {}
 
         try:
-            begin_time = (datetime.utcnow() - timedelta(days=days_back)).isoformat() + 'Z'
-            end_time = datetime.utcnow().isoformat() + 'Z'
+            return dict(_category_names(self, category_ids))
+        except Exception as e:
+            st.warning(f"Couldn't look up Square categories: {str(e)}")
+            return {}
+
+    def _payment_row(self, payment):
+        total_money = payment.total_money if hasattr(payment, 'total_money') else None
+        amount = (total_money.amount / 100.0) if total_money and hasattr(total_money, 'amount') else 0
+
+        return {
+            'id': payment.id if hasattr(payment, 'id') else '',
+            'amount': amount,
+            'status': payment.status if hasattr(payment, 'status') else 'UNKNOWN',
+            'created_at': payment.created_at if hasattr(payment, 'created_at') else '',
+            'receipt_number': payment.receipt_number if hasattr(payment, 'receipt_number') else '',
+        }
+
+    def _payment_pages(self, begin_time, end_time):
+        """Walk the ListPayments cursor chain, yielding one list of Square payments per page"""
+        cursor = None
 
-            result = self.client.payments.list(
+        while True:
+            result = self._request(
+                self.client.payments.list,
                 begin_time=begin_time,
                 end_time=end_time,
                 location_id=self.location_id,
-                limit=100
+                limit=100,
+                cursor=cursor
             )
 
-            payments = []
-            payment_list = result.payments if hasattr(result, 'payments') else []
-            for payment in payment_list:
-                total_money = payment.total_money if hasattr(payment, 'total_money') else None
-                amount = (total_money.amount / 100.0) if total_money and hasattr(total_money, 'amount') else 0
-
-                payments.append({
-                    'id': payment.id if hasattr(payment, 'id') else '',
-                    'amount': amount,
-                    'status': payment.status if hasattr(payment, 'status') else 'UNKNOWN',
-                    'created_at': payment.created_at if hasattr(payment, 'created_at') else '',
-                    'receipt_number': payment.receipt_number if hasattr(payment, 'receipt_number') else '',
-                })
-            return payments
+            # The SDK wraps list endpoints in a pager; the page itself is on .response
+            response = result.response if hasattr(result, 'response') else result
+            payment_list = response.payments if hasattr(response, 'payments') and response.payments else []
+            if payment_list:
+                yield payment_list
+
+            cursor = response.cursor if hasattr(response, 'cursor') else None
+            if not cursor:
+                break
+
+    def iter_payments(self, days_back=30):
+        """
+        Yield payments from the last days_back days one page (up to 100) at a
+        time, fetching the next page while the caller works on the current one.
+        API errors are raised to the caller.
+        """
+        if not self.is_configured or not self.location_id:
+            return
+
+        begin_time = (datetime.utcnow() - timedelta(days=days_back)).isoformat() + 'Z'
+        end_time = datetime.utcnow().isoformat() + 'Z'
+
+        for page in self._prefetch([self._payment_pages(begin_time, end_time)]):
+            yield [self._payment_row(payment) for payment in page]
+
+    def get_payments(self, days_back=30):
+        try:
+            return [payment for page in self.iter_payments(days_back) for payment in page]
 
         except ApiError as e:
             st.error(f"Square API error fetching payments: {str(e)}")
@@ -110,62 +246,210 @@ class SquareAPI:
             st.error(f"Exception fetching payments: {str(e)}")
             return []
 
-    def get_orders(self, days_back=30):
+    def _order_line_items(self, order):
+        """Flatten a Square order into one dict per line item"""
+        line_items = order.line_items if hasattr(order, 'line_items') and order.line_items else []
+        rows = []
+
+        for position, item in enumerate(line_items):
+            total_money = item.total_money if hasattr(item, 'total_money') else None
+            amount = (total_money.amount / 100.0) if total_money and hasattr(total_money, 'amount') else 0
+
+            rows.append({
+                'order_id': order.id if hasattr(order, 'id') else '',
+                'location_id': order.location_id if hasattr(order, 'location_id') else self.location_id,
+                # uid is unique within the order; fall back to the line position if missing
+                'line_uid': item.uid if hasattr(item, 'uid') and item.uid else f"pos-{position}",
+                'catalog_object_id': item.catalog_object_id if hasattr(item, 'catalog_object_id') else None,
+                'item_name': item.name if hasattr(item, 'name') else 'Unknown Item',
+                'quantity': int(item.quantity) if hasattr(item, 'quantity') else 1,
+                'total_amount': amount,
+                'created_at': order.created_at if hasattr(order, 'created_at') else '',
+                'updated_at': order.updated_at if hasattr(order, 'updated_at') else '',
+                'state': order.state if hasattr(order, 'state') else 'UNKNOWN'
+            })
+
+        return rows
+
+    def fetch_orders_by_ids(self, order_ids):
+        """Fetch line items for specific orders, 100 orders per request. Raises on API errors."""
         if not self.is_configured or not self.location_id:
             return []
 
-        try:
-            begin_time = (datetime.utcnow() - timedelta(days=days_back)).isoformat() + 'Z'
-            end_time = datetime.utcnow().isoformat() + 'Z'
+        orders = []
+        order_ids = list(order_ids)
 
-            orders = []
-            cursor = None
+        for start in range(0, len(order_ids), 100):
+            result = self._request(
+                self.client.orders.batch_get,
+                location_id=self.location_id,
+                order_ids=order_ids[start:start + 100]
+            )
 
-            while True:
-                query_filter = {
-                    'filter': {
-                        'date_time_filter': {
-                            'created_at': {
-                                'start_at': begin_time,
-                                'end_at': end_time
-                            }
+            order_list = result.orders if hasattr(result, 'orders') and result.orders else []
+            for order in order_list:
+                orders.extend(self._order_line_items(order))
+
+        return orders
+
+    def _order_pages(self, time_field, start_at, end_at):
+        """Walk one SearchOrders cursor chain over [start_at, end_at), yielding one list of Square orders per page"""
+        cursor = None
+
+        while True:
+            # Square requires the sort field to match the date filter field
+            query_filter = {
+                'filter': {
+                    'date_time_filter': {
+                        time_field: {
+                            'start_at': start_at.isoformat() + 'Z',
+                            'end_at': end_at.isoformat() + 'Z'
                         }
                     }
+                },
+                'sort': {
+                    'sort_field': time_field.upper(),
+                    'sort_order': 'ASC'
                 }
+            }
 
-                # Build search params - only include cursor if it exists
-                search_params = {
-                    'location_ids': [self.location_id],
-                    'query': query_filter,
-                    'limit': 100
-                }
-                if cursor:
-                    search_params['cursor'] = cursor
+            # Build search params - only include cursor if it exists
+            search_params = {
+                'location_ids': [self.location_id],
+                'query': query_filter,
+                'limit': 100
+            }
+            if cursor:
+                search_params['cursor'] = cursor
 
-                result = self.client.orders.search(**search_params)
+            result = self._request(self.client.orders.search, **search_params)
 
-                order_list = result.orders if hasattr(result, 'orders') and result.orders else []
-                for order in order_list:
-                    line_items = order.line_items if hasattr(order, 'line_items') and order.line_items else []
+            order_list = result.orders if hasattr(result, 'orders') and result.orders else []
+            if order_list:
+                yield order_list
 
-                    for item in line_items:
-                        total_money = item.total_money if hasattr(item, 'total_money') else None
-                        amount = (total_money.amount / 100.0) if total_money and hasattr(total_money, 'amount') else 0
+            cursor = result.cursor if hasattr(result, 'cursor') else None
+            if not cursor:
+                break
 
-                        orders.append({
-                            'order_id': order.id if hasattr(order, 'id') else '',
-                            'item_name': item.name if hasattr(item, 'name') else 'Unknown Item',
-                            'quantity': int(item.quantity) if hasattr(item, 'quantity') else 1,
-                            'total_amount': amount,
-                            'created_at': order.created_at if hasattr(order, 'created_at') else '',
-                            'state': order.state if hasattr(order, 'state') else 'UNKNOWN'
-                        })
+    @staticmethod
+    def _prefetch(chains, max_workers=1):
+        """
+        Run each page generator in chains on a worker thread (at most max_workers
+        at once) and yield pages as they arrive. Workers stay at most
+        PREFETCH_PAGES pages ahead of the consumer, so memory stays flat however
+        long the chains are. A worker's exception is re-raised here; closing the
+        generator early stops the workers after their current request.
+        """
+        pages = queue.Queue(maxsize=max_workers * PREFETCH_PAGES)
+        stop = threading.Event()
+        finished = object()
 
-                cursor = result.cursor if hasattr(result, 'cursor') else None
-                if not cursor:
-                    break
+        def put(item):
+            while not stop.is_set():
+                try:
+                    pages.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def drain(chain):
+            try:
+                if stop.is_set():
+                    return
+                for page in chain:
+                    if not put(page):
+                        return
+            except Exception as e:
+                put(e)
+            finally:
+                put(finished)
+
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            for chain in chains:
+                pool.submit(drain, chain)
+
+            try:
+                remaining = len(chains)
+                while remaining:
+                    item = pages.get()
+                    if item is finished:
+                        remaining -= 1
+                    elif isinstance(item, Exception):
+                        raise item
+                    else:
+                        yield item
+            finally:
+                stop.set()
+
+    @staticmethod
+    def _time_shards(start, end, shards):
+        """Split [start, end) into `shards` contiguous, equal-length ranges"""
+        step = (end - start) / shards
+        bounds = [start + step * i for i in range(shards)] + [end]
+        return list(zip(bounds[:-1], bounds[1:]))
+
+    @staticmethod
+    def _order_window(days_back, updated_since):
+        """(time_field, start, end) for orders created in the last days_back days, or updated since updated_since"""
+        if updated_since:
+            return 'updated_at', updated_since, datetime.utcnow()
+        return 'created_at', datetime.utcnow() - timedelta(days=days_back), datetime.utcnow()
+
+    def _order_chains(self, time_field, start, end, shards):
+        return [self._order_pages(time_field, *shard) for shard in self._time_shards(start, end, shards)]
+
+    def _merge_orders(self, orders, time_field):
+        """
+        Drop orders seen twice (shard edges) and flatten in (timestamp, order id)
+        order, so sequential and sharded fetches return identical lists
+        """
+        unique = {}
+        for order in orders:
+            unique.setdefault(order.id, order)
+
+        ordered = sorted(unique.values(), key=lambda order: (getattr(order, time_field, None) or '', order.id))
+
+        rows = []
+        for order in ordered:
+            rows.extend(self._order_line_items(order))
+        return rows
+
+    def iter_orders(self, days_back=30, updated_since=None, shards=1, max_workers=4):
+        """
+        Yield order line items one Square page (up to 100 orders) at a time, as
+        each page arrives, with the next pages fetched in the background. Takes
+        the same window and sharding arguments as get_orders. Pages come in
+        arrival order, so with shards > 1 they interleave across time ranges and
+        an order on a shard edge may appear twice. API errors are raised to the
+        caller after the pages already yielded.
+        """
+        if not self.is_configured or not self.location_id:
+            return
+
+        time_field, start, end = self._order_window(days_back, updated_since)
+        chains = self._order_chains(time_field, start, end, shards)
+
+        for page in self._prefetch(chains, max_workers=min(max_workers, shards)):
+            yield [row for order in page for row in self._order_line_items(order)]
+
+    def get_orders(self, days_back=30, updated_since=None, shards=1, max_workers=4):
+        """
+        Fetch order line items created in the last days_back days, or, when
+        updated_since (a datetime) is given, every order updated since then.
+        With shards > 1 the window is split into that many time ranges that are
+        paged through concurrently, at most max_workers at a time.
+        """
+        if not self.is_configured or not self.location_id:
+            return []
+
+        try:
+            time_field, start, end = self._order_window(days_back, updated_since)
+            chains = self._order_chains(time_field, start, end, shards)
 
-            return orders
+            orders = [order for page in self._prefetch(chains, max_workers=min(max_workers, shards)) for order in page]
+            return self._merge_orders(orders, time_field)
 
         except ApiError as e:
             st.error(f"Square API error fetching orders: {str(e)}")
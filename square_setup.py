@@ -1,8 +1,9 @@
 import streamlit as st
 from square_api import SquareAPI
 from database import get_session, close_session
-from models import SalesCache, Recipe
-from datetime import datetime
+from models import Recipe
+from sales_ingest import ingest_orders, get_unmapped_items, add_recipe_alias, BACKFILL_SHARDS
+from catalog_sync import import_catalog
 import os
 from styling import inject_custom_css, render_page_header
 
@@ -17,7 +18,7 @@ def show_square_setup():
     
     square_api = SquareAPI()
     
-    tab1, tab2, tab3 = st.tabs(["⚙️ Setup", "📥 Import Data", "ℹ️ Help"])
+    tab1, tab2, tab3, tab4 = st.tabs(["⚙️ Setup", "📥 Import Data", "🧩 Unmapped Items", "ℹ️ Help"])
     
     with tab1:
         st.subheader("API Configuration")
@@ -85,38 +86,25 @@ def show_square_setup():
                     st.write("**📦 Import Catalog Items**")
                     st.write("Import your menu items and pricing from Square to create recipes.")
                     
+                    full_import = st.checkbox(
+                        "Re-check the whole catalog",
+                        help="By default only items changed in Square since the last import are fetched."
+                    )
+                    
                     if st.button("📥 Import Catalog Items"):
-                        with st.spinner("Fetching catalog from Square..."):
-                            items = square_api.get_catalog_items()
+                        with st.spinner("Fetching catalog changes from Square..."):
+                            result = import_catalog(session, square_api, full=full_import)
                             
-                            if items:
-                                imported = 0
-                                updated = 0
-                                
-                                for item in items:
-                                    existing = session.query(Recipe).filter_by(square_item_id=item['id']).first()
-                                    
-                                    if existing:
-                                        existing.sale_price = item['price']
-                                        updated += 1
-                                    else:
-                                        new_recipe = Recipe(
-                                            name=item['name'],
-                                            square_item_id=item['id'],
-                                            sale_price=item['price'],
-                                            category='Imported from Square'
-                                        )
-                                        session.add(new_recipe)
-                                        imported += 1
-                                
-                                session.commit()
-                                
-                                st.success(f"✅ Imported {imported} new items, updated {updated} existing items!")
+                            if result['imported'] or result['updated']:
+                                st.success(f"✅ Imported {result['imported']} new items, updated {result['updated']} existing items!")
                                 
-                                if imported > 0:
+                                if result['imported'] > 0:
                                     st.info("💡 Don't forget to add ingredients to these recipes in the Recipe Database!")
                             else:
-                                st.warning("No catalog items found or error occurred.")
+                                st.info("Your recipes already match the Square catalog.")
+                            
+                            if result['skipped'] > 0:
+                                st.warning(f"⚠️ Skipped {result['skipped']} items whose name is already used by another recipe")
                 
                 with col2:
                     st.write("**💳 Import Sales Data**")
@@ -126,38 +114,16 @@ def show_square_setup():
                     
                     if st.button("📥 Import Sales"):
                         with st.spinner(f"Fetching sales from past {days_back} days..."):
-                            orders = square_api.get_orders(days_back=days_back)
+                            orders = square_api.get_orders(days_back=days_back, shards=BACKFILL_SHARDS)
                             
                             if orders:
-                                imported = 0
-                                skipped = 0
-                                errors = 0
-                                
-                                for order in orders:
-                                    try:
-                                        unique_id = f"{order['order_id']}_{order['item_name']}"
-                                        
-                                        existing = session.query(SalesCache).filter(
-                                            SalesCache.square_payment_id == unique_id
-                                        ).first()
-                                        
-                                        if not existing:
-                                            new_sale = SalesCache(
-                                                square_payment_id=unique_id,
-                                                item_name=order['item_name'],
-                                                quantity=order['quantity'],
-                                                total_amount=order['total_amount'],
-                                                timestamp=datetime.fromisoformat(order['created_at'].replace('Z', '+00:00'))
-                                            )
-                                            session.add(new_sale)
-                                            imported += 1
-                                        else:
-                                            skipped += 1
-                                    except Exception as e:
-                                        errors += 1
-                                        st.warning(f"Error importing order {order.get('order_id', 'unknown')}: {str(e)}")
+                                result = ingest_orders(session, orders)
+                                imported = result['imported']
+                                skipped = result['skipped']
+                                errors = len(result['errors'])
                                 
-                                session.commit()
+                                for error in result['errors']:
+                                    st.warning(f"Error importing order {error['order_id']}: {error['error']}")
                                 
                                 st.success(f"✅ Imported {imported} new sales transactions!")
                                 
@@ -178,6 +144,50 @@ def show_square_setup():
                 close_session(session)
     
     with tab3:
+        st.subheader("Unmapped Sales Items")
+        st.write("Sales whose Square item doesn't match any recipe. Map them to a recipe so they count towards profit and ingredient usage.")
+        
+        session = get_session()
+        
+        try:
+            unmapped = get_unmapped_items(session)
+            
+            if unmapped:
+                import pandas as pd
+                unmapped_df = pd.DataFrame([{
+                    'Item': item['item_name'],
+                    'Square ID': item['catalog_object_id'] or '',
+                    'Units Sold': int(item['units_sold']),
+                    'Revenue': f"£{item['revenue']:.2f}",
+                    'Last Sold': item['last_sold'].strftime('%Y-%m-%d') if item['last_sold'] else ''
+                } for item in unmapped])
+                st.dataframe(unmapped_df, use_container_width=True, hide_index=True)
+                
+                recipes = session.query(Recipe).order_by(Recipe.name).all()
+                
+                if recipes:
+                    with st.form("map_unmapped_item"):
+                        item_name = st.selectbox("Square item", [item['item_name'] for item in unmapped])
+                        recipe_id = st.selectbox(
+                            "Recipe",
+                            options=[r.id for r in recipes],
+                            format_func=lambda x: next(r.name for r in recipes if r.id == x)
+                        )
+                        
+                        if st.form_submit_button("🔗 Map to Recipe"):
+                            # Also rebuilds usage and the rollup for the remapped sales
+                            mapped = add_recipe_alias(session, recipe_id, item_name)
+                            st.success(f"✅ Mapped {mapped} sales to the recipe")
+                            st.rerun()
+                else:
+                    st.info("Add recipes first, then map these items to them.")
+            else:
+                st.success("✅ Every imported sale is matched to a recipe.")
+        
+        finally:
+            close_session(session)
+    
+    with tab4:
         st.subheader("Square Integration Help")
         
         st.write("""
@@ -0,0 +1,296 @@
+"""
+Standalone receiver for Square order webhooks, so sales land in the
+database as they happen instead of when the dashboard next syncs.
+
+order.created / order.updated events are signature-checked and the ids of
+COMPLETED orders queued in memory (order.created usually fires while the
+order is still OPEN; its order.updated to COMPLETED queues it). A worker
+loop batch-fetches queued orders and runs them through
+sales_ingest.ingest_orders, re-queueing a batch that fails up to
+MAX_ATTEMPTS times. The queue isn't durable, so the worker also runs the
+regular watermark sync every --sync-interval seconds to pick up anything
+missed while it was down, dropped by Square or given up on.
+
+    python square_webhooks.py serve --port 8080
+    python square_webhooks.py replay recorded/*.json    # recorded event bodies, no HTTP
+
+Needs DATABASE_URL, SQUARE_ACCESS_TOKEN and SQUARE_LOCATION_ID, plus
+SQUARE_WEBHOOK_SIGNATURE_KEY and SQUARE_WEBHOOK_URL (the notification URL
+exactly as registered with Square) to verify deliveries.
+"""
+import base64
+import hashlib
+import hmac
+import json
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ORDER_EVENTS = {'order.created', 'order.updated'}
+SIGNATURE_HEADER = 'x-square-hmacsha256-signature'
+# Orders per BatchRetrieveOrders call, and how long the worker waits to fill a batch
+BATCH_SIZE = 100
+BATCH_WAIT = 2.0
+SYNC_INTERVAL = 900
+# Square redelivers events it didn't see acknowledged; remember this many event ids
+SEEN_EVENTS = 10000
+# Fetch attempts per order before leaving it to the catch-up sync, and the pause after a failed batch
+MAX_ATTEMPTS = 3
+RETRY_DELAY = 5.0
+
+def sign(body, signature_key, notification_url):
+    """Square's signature: base64 HMAC-SHA256 of the notification URL followed by the raw body"""
+    digest = hmac.new(signature_key.encode(), notification_url.encode() + body, hashlib.sha256).digest()
+    return base64.b64encode(digest).decode()
+
+def verify_signature(body, signature, signature_key, notification_url):
+    if not signature:
+        return False
+    return hmac.compare_digest(sign(body, signature_key, notification_url), signature)
+
+def order_id_from_event(event, location_id=None):
+    """The order id of an order.created/updated event for a COMPLETED order at location_id, else None"""
+    if event.get('type') not in ORDER_EVENTS:
+        return None
+
+    data = event.get('data') or {}
+    # data.object is {"order_created": {...}} or {"order_updated": {...}}
+    details = next((value for value in (data.get('object') or {}).values() if isinstance(value, dict)), {})
+
+    if location_id and (details.get('location_id') or event.get('location_id')) not in (None, location_id):
+        return None
+    if details.get('state') and details['state'] != 'COMPLETED':
+        return None
+    return data.get('id') or details.get('order_id')
+
+
+class OrderQueue:
+    """Order ids waiting to be fetched, deduplicated until taken, plus recently seen event ids"""
+    def __init__(self):
+        self.pending = queue.Queue()
+        self.queued = set()
+        self.seen_events = OrderedDict()
+        self.attempts = {}
+        self.lock = threading.Lock()
+
+    def add_event(self, event, location_id=None):
+        """Queue the event's order id. Returns False for redeliveries and events that aren't order changes."""
+        order_id = order_id_from_event(event, location_id)
+        if not order_id:
+            return False
+
+        with self.lock:
+            event_id = event.get('event_id')
+            if event_id:
+                if event_id in self.seen_events:
+                    return False
+                self.seen_events[event_id] = True
+                while len(self.seen_events) > SEEN_EVENTS:
+                    self.seen_events.popitem(last=False)
+
+            # An order updated several times before the worker gets to it is fetched once
+            if order_id in self.queued:
+                return True
+            self.queued.add(order_id)
+
+        self.pending.put(order_id)
+        return True
+
+    def take_batch(self, size=BATCH_SIZE, wait=BATCH_WAIT):
+        """Wait up to wait seconds for the first id, then collect up to size ids until wait runs out"""
+        try:
+            batch = [self.pending.get(timeout=wait) if wait > 0 else self.pending.get_nowait()]
+        except queue.Empty:
+            return []
+
+        deadline = time.monotonic() + wait
+        while len(batch) < size:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self.pending.get(timeout=remaining) if remaining > 0 else self.pending.get_nowait())
+            except queue.Empty:
+                break
+
+        with self.lock:
+            self.queued.difference_update(batch)
+        return batch
+
+    def requeue(self, order_ids, max_attempts=MAX_ATTEMPTS):
+        """Put the ids of a failed batch back. Returns the ids dropped after max_attempts failures."""
+        dropped = []
+        requeued = []
+        with self.lock:
+            for order_id in order_ids:
+                self.attempts[order_id] = self.attempts.get(order_id, 0) + 1
+                if self.attempts[order_id] >= max_attempts:
+                    del self.attempts[order_id]
+                    dropped.append(order_id)
+                elif order_id not in self.queued:
+                    self.queued.add(order_id)
+                    requeued.append(order_id)
+
+        for order_id in requeued:
+            self.pending.put(order_id)
+        return dropped
+
+    def done(self, order_ids):
+        """Forget the failed attempts of orders that have now been ingested"""
+        with self.lock:
+            for order_id in order_ids:
+                self.attempts.pop(order_id, None)
+
+
+def ingest_order_ids(session, square_api, order_ids):
+    """Fetch order_ids from Square in one batch and write them through the normal ingestion path"""
+    from sales_ingest import ingest_orders
+
+    orders = square_api.fetch_orders_by_ids(order_ids)
+    if not orders:
+        return {'imported': 0, 'skipped': 0, 'not_completed': 0, 'errors': [], 'total_orders': 0}
+    return ingest_orders(session, orders)
+
+def run_worker(order_queue, session_factory, square_api, stop, sync_interval=SYNC_INTERVAL):
+    """Drain order_queue in batches until stop is set, with a catch-up watermark sync every sync_interval seconds"""
+    from sales_ingest import sync_square_sales
+
+    next_sync = time.monotonic()
+    while not stop.is_set():
+        if sync_interval and time.monotonic() >= next_sync:
+            next_sync = time.monotonic() + sync_interval
+            session = session_factory()
+            try:
+                result = sync_square_sales(session, square_api)
+                print(f"catch-up sync: {result['imported']} new sales lines")
+            except Exception as e:
+                print(f"catch-up sync failed: {e}")
+            finally:
+                session.close()
+
+        batch = order_queue.take_batch()
+        if not batch:
+            continue
+
+        session = session_factory()
+        try:
+            result = ingest_order_ids(session, square_api, batch)
+            order_queue.done(batch)
+            print(f"{len(batch)} orders: {result['imported']} new sales lines, {result['skipped']} already stored")
+        except Exception as e:
+            session.rollback()
+            dropped = order_queue.requeue(batch)
+            print(f"failed to ingest {len(batch)} orders, {len(batch) - len(dropped)} re-queued: {e}")
+            if dropped:
+                print(f"giving up on {len(dropped)} orders until the next catch-up sync")
+            stop.wait(RETRY_DELAY)
+        finally:
+            session.close()
+
+
+class WebhookHandler(BaseHTTPRequestHandler):
+    order_queue = None
+    signature_key = None
+    notification_url = None
+    location_id = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status):
+        self.send_response(status)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+
+        if not verify_signature(body, self.headers.get(SIGNATURE_HEADER), self.signature_key, self.notification_url):
+            self._reply(403)
+            return
+
+        try:
+            event = json.loads(body)
+        except ValueError:
+            self._reply(400)
+            return
+
+        # Acknowledge every valid event, including ones we ignore, so Square doesn't redeliver them
+        self.order_queue.add_event(event, self.location_id)
+        self._reply(200)
+
+
+def start_receiver(order_queue, signature_key, notification_url, location_id=None, port=0):
+    """Serve the webhook endpoint on a background thread. Returns (server, url)."""
+    handler = type('Handler', (WebhookHandler,), {
+        'order_queue': order_queue,
+        'signature_key': signature_key,
+        'notification_url': notification_url,
+        'location_id': location_id,
+    })
+    server = ThreadingHTTPServer(('0.0.0.0', port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+def _session_factory():
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+    from database import get_database_url
+
+    database_url = get_database_url()
+    if not database_url:
+        print("ERROR: DATABASE_URL not set")
+        raise SystemExit(1)
+    return sessionmaker(bind=create_engine(database_url, pool_pre_ping=True))
+
+if __name__ == "__main__":
+    import argparse
+    from square_api import SquareAPI
+
+    parser = argparse.ArgumentParser(description="Square order webhook receiver")
+    parser.add_argument('command', choices=['serve', 'replay'], nargs='?', default='serve')
+    parser.add_argument('files', nargs='*', help="recorded event bodies to replay")
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--sync-interval', type=int, default=SYNC_INTERVAL, help="seconds between catch-up syncs, 0 to disable")
+    args = parser.parse_args()
+
+    square_api = SquareAPI()
+    if not square_api.is_configured:
+        print("ERROR: SQUARE_ACCESS_TOKEN not set")
+        raise SystemExit(1)
+
+    session_factory = _session_factory()
+    order_queue = OrderQueue()
+
+    if args.command == 'replay':
+        for path in args.files:
+            with open(path, 'rb') as f:
+                queued = order_queue.add_event(json.loads(f.read()), square_api.location_id)
+            print(f"{path}: {'queued' if queued else 'ignored'}")
+
+        while True:
+            batch = order_queue.take_batch(wait=0)
+            if not batch:
+                break
+            session = session_factory()
+            try:
+                result = ingest_order_ids(session, square_api, batch)
+                print(f"{len(batch)} orders: {result['imported']} new sales lines, {result['skipped']} already stored")
+            finally:
+                session.close()
+    else:
+        signature_key = os.getenv('SQUARE_WEBHOOK_SIGNATURE_KEY')
+        notification_url = os.getenv('SQUARE_WEBHOOK_URL')
+        if not signature_key or not notification_url:
+            print("ERROR: SQUARE_WEBHOOK_SIGNATURE_KEY and SQUARE_WEBHOOK_URL must be set")
+            raise SystemExit(1)
+
+        stop = threading.Event()
+        server, _ = start_receiver(order_queue, signature_key, notification_url, square_api.location_id, port=args.port)
+        print(f"Listening for Square webhooks on port {args.port}")
+        try:
+            run_worker(order_queue, session_factory, square_api, stop, sync_interval=args.sync_interval)
+        except KeyboardInterrupt:
+            stop.set()
+            server.shutdown()
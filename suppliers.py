@@ -2,9 +2,12 @@ import streamlit as st
 from styling import inject_custom_css, render_page_header
 from database import get_session, close_session
 from models import Supplier, Ingredient, SupplierOrder, SupplierOrderItem
+from utils import get_supplier_orders_page, get_recent_orders_by_supplier
+from sqlalchemy.orm import selectinload
 from datetime import datetime, timedelta
-import pandas as pd
-from receipt_parser import parse_receipt_with_ai, extract_text_from_image, parse_receipt_text
+
+ORDER_STATUSES = ['pending', 'ordered', 'delivered', 'cancelled']
+ORDERS_PER_PAGE = 20
 
 def show_suppliers():
     inject_custom_css()
@@ -19,7 +22,10 @@ def show_suppliers():
         with tab1:
             st.subheader("Active Suppliers")
             
-            suppliers = session.query(Supplier).order_by(Supplier.name).all()
+            suppliers = session.query(Supplier).options(
+                selectinload(Supplier.ingredients)
+            ).order_by(Supplier.name).all()
+            recent_orders = get_recent_orders_by_supplier(session, limit=5)
             
             if suppliers:
                 for supplier in suppliers:
@@ -38,17 +44,13 @@ def show_suppliers():
                         if supplier.notes:
                             st.write(f"**Notes:** {supplier.notes}")
                         
-                        ingredients = session.query(Ingredient).filter(
-                            Ingredient.supplier_id == supplier.id
-                        ).all()
+                        ingredients = supplier.ingredients
                         
                         if ingredients:
                             st.write(f"**Supplies {len(ingredients)} ingredients:**")
                             st.write(", ".join([ing.name for ing in ingredients]))
                         
-                        orders = session.query(SupplierOrder).filter(
-                            SupplierOrder.supplier_id == supplier.id
-                        ).order_by(SupplierOrder.order_date.desc()).limit(5).all()
+                        orders = recent_orders.get(supplier.id, [])
                         
                         if orders:
                             st.write(f"**Recent Orders ({len(orders)}):**")
@@ -126,13 +128,43 @@ def show_suppliers():
         with tab2:
             st.subheader("Order History")
             
-            orders = session.query(SupplierOrder).order_by(
-                SupplierOrder.order_date.desc()
-            ).all()
+            col_status, col_supplier, col_dates = st.columns(3)
+            
+            with col_status:
+                statuses = st.multiselect("Status", ORDER_STATUSES, key="order_filter_status")
+            
+            with col_supplier:
+                supplier_names = dict(session.query(Supplier.name, Supplier.id).order_by(Supplier.name).all())
+                supplier_filter = st.selectbox("Supplier", ["All Suppliers"] + list(supplier_names), key="order_filter_supplier")
+            
+            with col_dates:
+                date_range = st.date_input("Order Date", value=(), key="order_filter_dates")
+            
+            start_date = end_date = None
+            if len(date_range) == 2:
+                start_date = datetime.combine(date_range[0], datetime.min.time())
+                end_date = datetime.combine(date_range[1], datetime.min.time()) + timedelta(days=1)
+            
+            # Cursors of the pages visited so far; any filter change starts again at page one
+            filters = (tuple(statuses), supplier_filter, tuple(date_range))
+            if st.session_state.get('order_filters') != filters:
+                st.session_state['order_filters'] = filters
+                st.session_state['order_cursors'] = [None]
+            cursors = st.session_state['order_cursors']
+            
+            orders, next_cursor = get_supplier_orders_page(
+                session,
+                cursor=cursors[-1],
+                page_size=ORDERS_PER_PAGE,
+                statuses=statuses,
+                supplier_id=supplier_names.get(supplier_filter),
+                start_date=start_date,
+                end_date=end_date
+            )
             
             if orders:
                 for order in orders:
-                    supplier = session.query(Supplier).get(order.supplier_id)
+                    supplier = order.supplier
                     
                     status_emoji = {
                         'pending': '⏳',
@@ -162,7 +194,7 @@ def show_suppliers():
                             st.write("**Items:**")
                             items_data = []
                             for item in order.order_items:
-                                ingredient = session.query(Ingredient).get(item.ingredient_id)
+                                ingredient = item.ingredient
                                 if ingredient:
                                     items_data.append({
                                         'Ingredient': ingredient.name,
@@ -172,6 +204,7 @@ def show_suppliers():
                                     })
                             
                             if items_data:
+                                import pandas as pd
                                 df = pd.DataFrame(items_data)
                                 st.dataframe(df, use_container_width=True, hide_index=True)
                         
@@ -184,9 +217,8 @@ def show_suppliers():
                                     order.actual_delivery_date = datetime.utcnow()
                                     
                                     for item in order.order_items:
-                                        ingredient = session.query(Ingredient).get(item.ingredient_id)
-                                        if ingredient:
-                                            ingredient.current_stock += item.quantity
+                                        if item.ingredient:
+                                            item.ingredient.current_stock += item.quantity
                                     
                                     session.commit()
                                     st.success("Order marked as delivered and stock updated!")
@@ -198,6 +230,23 @@ def show_suppliers():
                                     session.commit()
                                     st.success("Order cancelled")
                                     st.rerun()
+                
+                col_prev, col_page, col_next = st.columns([1, 2, 1])
+                
+                with col_prev:
+                    if len(cursors) > 1 and st.button("⬅️ Newer", key="orders_prev"):
+                        cursors.pop()
+                        st.rerun()
+                
+                with col_page:
+                    st.caption(f"Page {len(cursors)}")
+                
+                with col_next:
+                    if next_cursor and st.button("Older ➡️", key="orders_next"):
+                        cursors.append(next_cursor)
+                        st.rerun()
+            elif len(cursors) > 1 or statuses or supplier_filter != "All Suppliers" or start_date:
+                st.info("No orders match these filters.")
             else:
                 st.info("📭 No orders yet. Create orders from the Inventory Alerts page.")
         
@@ -219,6 +268,8 @@ def show_suppliers():
             all_parsed_data = []
 
             if uploaded_files:
+                from receipt_parser import parse_receipt_with_ai, extract_text_from_image, parse_receipt_text
+
                 for idx, uploaded_file in enumerate(uploaded_files):
                     st.markdown(f"**Processing: {uploaded_file.name}**")
 
@@ -318,6 +369,7 @@ def show_suppliers():
                                     'Net Amount': f"£{item.get('total_cost', 0):.2f}"
                                 })
 
+                            import pandas as pd
                             items_df = pd.DataFrame(display_items)
                             st.dataframe(items_df, use_container_width=True, hide_index=True)
                         else:
@@ -0,0 +1,60 @@
+import os
+import sys
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from migrations import run_migrations
+from models import Ingredient, Recipe, RecipeItem
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'bakery.db'}")
+    run_migrations(engine)
+    yield engine
+    engine.dispose()
+
+@pytest.fixture
+def session(engine):
+    session = sessionmaker(bind=engine)()
+    yield session
+    session.close()
+
+@pytest.fixture
+def bakery(session):
+    """Recipes for the fake_square items, each using flour and butter"""
+    from fake_square import ITEMS
+
+    flour = Ingredient(name='Flour', unit='g', cost_per_unit=0.002)
+    butter = Ingredient(name='Butter', unit='g', cost_per_unit=0.01)
+    session.add_all([flour, butter])
+    session.flush()
+
+    for position, name in enumerate(ITEMS):
+        recipe = Recipe(name=name, square_item_id=f"VAR-{position}", sale_price=3.5)
+        recipe.recipe_items = [
+            RecipeItem(ingredient_id=flour.id, quantity=100 + 10 * position),
+            RecipeItem(ingredient_id=butter.id, quantity=50),
+        ]
+        session.add(recipe)
+    session.commit()
+
+
+def order_lines(orders):
+    """fake_square order dicts flattened the way SquareAPI returns them, one dict per line item"""
+    return [{
+        'order_id': order['id'],
+        'location_id': order['location_id'],
+        'line_uid': item['uid'],
+        'catalog_object_id': item['catalog_object_id'],
+        'item_name': item['name'],
+        'quantity': int(item['quantity']),
+        'total_amount': item['total_money']['amount'] / 100.0,
+        'created_at': order['created_at'],
+        'updated_at': order['updated_at'],
+        'state': order['state']
+    } for order in orders for item in order['line_items']]
@@ -0,0 +1,123 @@
+import pytest
+from sqlalchemy import func, select, update
+from sqlalchemy.orm import sessionmaker
+
+from data_versions import cached_on, get_versions, has_pending_writes
+from models import Ingredient
+
+
+@pytest.fixture
+def other_session(engine):
+    session = sessionmaker(bind=engine)()
+    yield session
+    session.close()
+
+@pytest.fixture
+def count_ingredients():
+    calls = []
+
+    @cached_on('ingredients')
+    def count(session):
+        calls.append(1)
+        return session.execute(select(func.count(Ingredient.id))).scalar()
+
+    count.calls = calls
+    return count
+
+def version(session):
+    return get_versions(session, ['ingredients'])[0]
+
+
+def test_commit_bumps_version_after_commit(session):
+    before = version(session)
+
+    session.add(Ingredient(name='Flour', unit='g'))
+    session.flush()
+    assert version(session) == before
+    assert has_pending_writes(session)
+
+    session.commit()
+    assert version(session) == before + 1
+    assert not has_pending_writes(session)
+
+def test_rollback_does_not_bump(session):
+    before = version(session)
+
+    session.add(Ingredient(name='Flour', unit='g'))
+    session.flush()
+    session.rollback()
+    session.commit()
+
+    assert version(session) == before
+
+def test_savepoint_rollback_keeps_outer_writes_pending(session):
+    before = version(session)
+
+    session.add(Ingredient(name='Flour', unit='g'))
+    session.flush()
+    with session.begin_nested() as savepoint:
+        session.add(Ingredient(name='Butter', unit='g'))
+        session.flush()
+        savepoint.rollback()
+    session.commit()
+
+    assert version(session) == before + 1
+
+def test_bulk_statement_bumps(session):
+    session.add(Ingredient(name='Flour', unit='g'))
+    session.commit()
+    before = version(session)
+
+    session.execute(update(Ingredient).values(cost_per_unit=0.5))
+    session.commit()
+
+    assert version(session) == before + 1
+
+def test_untracked_tables_are_not_versioned(session):
+    from database import set_setting
+
+    set_setting(session, 'anything', 'value')
+    session.commit()
+
+    assert get_versions(session, ['settings']) == (0,)
+
+
+def test_cached_result_is_reused_until_a_write(session, count_ingredients):
+    assert count_ingredients(session) == 0
+    assert count_ingredients(session) == 0
+    assert len(count_ingredients.calls) == 1
+
+    session.add(Ingredient(name='Flour', unit='g'))
+    session.commit()
+
+    assert count_ingredients(session) == 1
+    assert len(count_ingredients.calls) == 2
+
+def test_commit_in_another_session_invalidates(session, other_session, count_ingredients):
+    assert count_ingredients(session) == 0
+
+    other_session.add(Ingredient(name='Flour', unit='g'))
+    other_session.commit()
+
+    assert count_ingredients(session) == 1
+
+def test_pending_writes_bypass_the_cache(session, count_ingredients):
+    assert count_ingredients(session) == 0
+
+    session.add(Ingredient(name='Flour', unit='g'))
+    # Sees its own uncommitted row instead of the cached count
+    assert count_ingredients(session) == 1
+    session.rollback()
+
+    # The uncommitted result wasn't cached under the unchanged version
+    assert count_ingredients(session) == 0
+    assert len(count_ingredients.calls) == 2
+
+def test_cached_results_are_copies(session):
+    @cached_on('ingredients')
+    def names(session):
+        return [name for (name,) in session.execute(select(Ingredient.name))]
+
+    names(session).append('Changed')
+
+    assert names(session) == []
@@ -0,0 +1,120 @@
+import threading
+
+import pytest
+from sqlalchemy.orm import sessionmaker
+
+import sales_ingest
+from fake_square import make_orders
+from models import DailyUsage, SalesDaily
+from sales_ingest import ingest_orders
+from sales_rollup import rebuild_sales_daily, update_sales_daily
+from usage_accounting import rebuild_daily_usage, update_usage_from_sales
+
+from conftest import order_lines
+
+
+def daily_usage(session):
+    return {
+        (row.ingredient_id, row.date): pytest.approx(row.quantity_used)
+        for row in session.query(DailyUsage) if row.quantity_used
+    }
+
+def sales_daily(session):
+    return {
+        (row.business_date, row.item_name, row.location_id): (
+            row.recipe_id, row.units, row.transactions, pytest.approx(row.gross_revenue), pytest.approx(row.cost)
+        )
+        for row in session.query(SalesDaily)
+    }
+
+def ingest_in_batches(session, lines, batch_size=40):
+    for start in range(0, len(lines), batch_size):
+        ingest_orders(session, lines[start:start + batch_size])
+
+
+def test_incremental_usage_matches_rebuild(session, bakery):
+    ingest_in_batches(session, order_lines(make_orders(count=200)))
+    incremental = daily_usage(session)
+
+    rebuild_daily_usage(session)
+
+    assert incremental
+    assert daily_usage(session) == incremental
+
+def test_incremental_rollup_matches_rebuild(session, bakery):
+    ingest_in_batches(session, order_lines(make_orders(count=200)))
+    incremental = sales_daily(session)
+
+    rebuild_sales_daily(session)
+
+    assert incremental
+    assert sales_daily(session) == incremental
+
+def test_incremental_stages_continue_after_rebuild(session, bakery):
+    lines = order_lines(make_orders(count=200))
+    ingest_in_batches(session, lines[:150])
+    rebuild_daily_usage(session)
+    rebuild_sales_daily(session)
+
+    ingest_in_batches(session, lines[150:])
+    usage, rollup = daily_usage(session), sales_daily(session)
+
+    rebuild_daily_usage(session)
+    rebuild_sales_daily(session)
+    assert daily_usage(session) == usage
+    assert sales_daily(session) == rollup
+
+def test_incremental_stages_are_idempotent(session, bakery):
+    ingest_in_batches(session, order_lines(make_orders(count=50)))
+    usage, rollup = daily_usage(session), sales_daily(session)
+
+    assert update_usage_from_sales(session) == 0
+    assert update_sales_daily(session) == 0
+    assert daily_usage(session) == usage
+    assert sales_daily(session) == rollup
+
+def test_concurrent_ingests_are_all_accounted(engine, session, bakery, monkeypatch):
+    lines = order_lines(make_orders(count=60))
+    first, second = lines[:len(lines) // 2], lines[len(lines) // 2:]
+
+    # Hold the first ingest between its insert and its commit
+    inserted, release = threading.Event(), threading.Event()
+    insert = sales_ingest._insert_ignoring_duplicates
+
+    def paused_insert(session, rows):
+        count = insert(session, rows)
+        if threading.current_thread().name == 'first':
+            inserted.set()
+            release.wait(5)
+        return count
+    monkeypatch.setattr(sales_ingest, '_insert_ignoring_duplicates', paused_insert)
+
+    factory = sessionmaker(bind=engine)
+    results = {}
+
+    def run(name, batch):
+        with factory() as ingest_session:
+            results[name] = ingest_orders(ingest_session, batch)['imported']
+
+    first_thread = threading.Thread(target=run, args=('first', first), name='first')
+    second_thread = threading.Thread(target=run, args=('second', second), name='second')
+    first_thread.start()
+    assert inserted.wait(5)
+    second_thread.start()
+
+    # The second ingest waits for the first to commit instead of committing ahead of it
+    second_thread.join(0.5)
+    assert second_thread.is_alive()
+    release.set()
+    first_thread.join(10)
+    second_thread.join(10)
+
+    assert results == {'first': len(first), 'second': len(second)}
+    session.expire_all()
+    usage, rollup = daily_usage(session), sales_daily(session)
+    assert sum(units for _, units, *_ in rollup.values()) == sum(line['quantity'] for line in lines)
+
+    rebuild_daily_usage(session)
+    rebuild_sales_daily(session)
+    assert daily_usage(session) == usage
+    assert sales_daily(session) == rollup
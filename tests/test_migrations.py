@@ -0,0 +1,124 @@
+import pytest
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.orm import Session
+
+from migrations import LATEST_VERSION, get_schema_version, run_migrations
+from models import DailyUsage, RecipeCost, SalesCache, SalesDaily
+
+# The tables as the first release's create_all built them, before schema_migrations existed
+BASELINE_SCHEMA = [
+    """CREATE TABLE suppliers (
+        id INTEGER PRIMARY KEY, name VARCHAR(200) NOT NULL UNIQUE, contact_name VARCHAR(200),
+        email VARCHAR(200), phone VARCHAR(50), address TEXT, notes TEXT, lead_time_days INTEGER,
+        created_at DATETIME, updated_at DATETIME
+    )""",
+    """CREATE TABLE ingredients (
+        id INTEGER PRIMARY KEY, name VARCHAR(200) NOT NULL UNIQUE, unit VARCHAR(50) NOT NULL,
+        cost_per_unit FLOAT, current_stock FLOAT, supplier VARCHAR(200), last_updated DATETIME,
+        supplier_lead_time_days INTEGER
+    )""",
+    """CREATE TABLE recipes (
+        id INTEGER PRIMARY KEY, name VARCHAR(200) NOT NULL UNIQUE, square_item_id VARCHAR(200),
+        sale_price FLOAT, category VARCHAR(100), description TEXT, created_at DATETIME, updated_at DATETIME
+    )""",
+    """CREATE TABLE recipe_items (
+        id INTEGER PRIMARY KEY, recipe_id INTEGER NOT NULL REFERENCES recipes(id),
+        ingredient_id INTEGER NOT NULL REFERENCES ingredients(id), quantity FLOAT NOT NULL
+    )""",
+    """CREATE TABLE sales_cache (
+        id INTEGER PRIMARY KEY, square_payment_id VARCHAR(200) UNIQUE, item_name VARCHAR(200),
+        quantity INTEGER, total_amount FLOAT, timestamp DATETIME NOT NULL, created_at DATETIME
+    )""",
+    """CREATE TABLE settings (
+        id INTEGER PRIMARY KEY, key VARCHAR(100) NOT NULL UNIQUE, value TEXT, updated_at DATETIME
+    )""",
+    """CREATE TABLE daily_usage (
+        id INTEGER PRIMARY KEY, ingredient_id INTEGER NOT NULL REFERENCES ingredients(id),
+        date DATETIME NOT NULL, quantity_used FLOAT
+    )""",
+    """CREATE TABLE profit_history (
+        id INTEGER PRIMARY KEY, recipe_id INTEGER NOT NULL REFERENCES recipes(id), date DATETIME NOT NULL,
+        sale_price FLOAT, ingredient_cost FLOAT, profit FLOAT, profit_margin FLOAT, quantity_sold INTEGER
+    )""",
+    """CREATE TABLE supplier_orders (
+        id INTEGER PRIMARY KEY, supplier_id INTEGER NOT NULL REFERENCES suppliers(id), order_date DATETIME,
+        expected_delivery_date DATETIME, actual_delivery_date DATETIME, status VARCHAR(50),
+        total_cost FLOAT, notes TEXT, created_at DATETIME
+    )""",
+]
+
+BASELINE_DATA = [
+    "INSERT INTO ingredients (id, name, unit, cost_per_unit, current_stock) VALUES (1, 'Flour', 'g', 0.002, 5000)",
+    "INSERT INTO recipes (id, name, sale_price) VALUES (1, 'Brownie', 3.5)",
+    "INSERT INTO recipe_items (recipe_id, ingredient_id, quantity) VALUES (1, 1, 120)",
+    # Sales imported under the old "<order_id>_<item_name>" key
+    "INSERT INTO sales_cache (square_payment_id, item_name, quantity, total_amount, timestamp) "
+    "VALUES ('ORDER1_Brownie', 'Brownie', 2, 7.0, '2026-01-05 10:00:00')",
+    "INSERT INTO sales_cache (square_payment_id, item_name, quantity, total_amount, timestamp) "
+    "VALUES ('ORDER2_Brownie', 'Brownie', 1, 3.5, '2026-01-06 11:30:00')",
+]
+
+
+def baseline_engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'baseline.db'}")
+    with engine.begin() as conn:
+        for statement in BASELINE_SCHEMA + BASELINE_DATA:
+            conn.execute(text(statement))
+    return engine
+
+
+def test_run_migrations_upgrades_baseline_database(tmp_path):
+    engine = baseline_engine(tmp_path)
+    assert get_schema_version(engine) == 0
+
+    applied = run_migrations(engine)
+
+    assert applied == list(range(1, LATEST_VERSION + 1))
+    assert get_schema_version(engine) == LATEST_VERSION
+
+    columns = {column['name'] for column in inspect(engine).get_columns('sales_cache')}
+    assert {'order_id', 'line_uid', 'catalog_object_id', 'recipe_id', 'location_id'} <= columns
+    assert 'supplier_id' in {column['name'] for column in inspect(engine).get_columns('ingredients')}
+    assert 'square_version' in {column['name'] for column in inspect(engine).get_columns('recipes')}
+    engine.dispose()
+
+def test_run_migrations_keys_and_maps_legacy_sales(tmp_path):
+    engine = baseline_engine(tmp_path)
+    run_migrations(engine)
+
+    with Session(engine) as session:
+        rows = session.query(SalesCache).order_by(SalesCache.id).all()
+        assert [(row.order_id, row.line_uid) for row in rows] == [('ORDER1', 'legacy-1'), ('ORDER2', 'legacy-2')]
+        assert [row.recipe_id for row in rows] == [1, 1]
+
+        # Migration 8 rebuilt the derived tables from the legacy sales
+        assert sum(row.quantity_used for row in session.query(DailyUsage)) == 360
+        assert sum(row.units for row in session.query(SalesDaily)) == 3
+        assert session.get(RecipeCost, 1).cost == pytest.approx(0.24)
+    engine.dispose()
+
+def test_run_migrations_is_a_no_op_when_current(tmp_path):
+    engine = baseline_engine(tmp_path)
+    run_migrations(engine)
+
+    assert run_migrations(engine) == []
+    engine.dispose()
+
+def test_run_migrations_on_empty_database(engine):
+    assert get_schema_version(engine) == LATEST_VERSION
+    assert run_migrations(engine) == []
+
+def test_run_migrations_is_quiet_unless_verbose(tmp_path, capsys):
+    engine = baseline_engine(tmp_path)
+    run_migrations(engine)
+    assert capsys.readouterr().out == ''
+    engine.dispose()
+
+def test_run_migrations_verbose_reports_data_migrations(tmp_path, capsys):
+    engine = baseline_engine(tmp_path)
+    run_migrations(engine, verbose=True)
+
+    out = capsys.readouterr().out
+    assert 'rebuilt line keys for 2 sales rows' in out
+    assert 'resolved recipe_id for 2 sales rows' in out
+    engine.dispose()
@@ -0,0 +1,108 @@
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import delete, insert, update
+
+from models import Ingredient, Recipe, RecipeCost, RecipeItem
+from recipe_costing import get_margin_changes
+
+
+@pytest.fixture
+def costed(session):
+    """Bread uses flour and butter, cake uses butter; both costed on commit"""
+    flour = Ingredient(name='Flour', unit='g', cost_per_unit=0.002)
+    butter = Ingredient(name='Butter', unit='g', cost_per_unit=0.01)
+    bread = Recipe(name='Bread', sale_price=3.0)
+    cake = Recipe(name='Cake', sale_price=4.0)
+    bread.recipe_items = [RecipeItem(ingredient=flour, quantity=500), RecipeItem(ingredient=butter, quantity=20)]
+    cake.recipe_items = [RecipeItem(ingredient=butter, quantity=100)]
+    session.add_all([bread, cake])
+    session.commit()
+    return {'flour': flour.id, 'butter': butter.id, 'bread': bread.id, 'cake': cake.id}
+
+def stored_costs(session):
+    session.expire_all()
+    return {row.recipe_id: row.cost for row in session.query(RecipeCost)}
+
+
+def test_new_recipes_are_costed_on_commit(session, costed):
+    assert stored_costs(session) == {costed['bread']: pytest.approx(1.2), costed['cake']: pytest.approx(1.0)}
+
+def test_orm_cost_per_unit_change_recosts_recipes_using_it(session, costed):
+    session.get(Ingredient, costed['flour']).cost_per_unit = 0.004
+    session.commit()
+
+    assert stored_costs(session) == {costed['bread']: pytest.approx(2.2), costed['cake']: pytest.approx(1.0)}
+
+def test_orm_sale_price_change_updates_margin(session, costed):
+    session.get(Recipe, costed['cake']).sale_price = 5.0
+    session.commit()
+
+    session.expire_all()
+    assert session.get(RecipeCost, costed['cake']).margin == pytest.approx(80.0)
+
+def test_bulk_update_by_primary_key_recosts_recipes(session, costed):
+    session.execute(update(Ingredient), [{'id': costed['butter'], 'cost_per_unit': 0.02}])
+    session.commit()
+
+    assert stored_costs(session) == {costed['bread']: pytest.approx(1.4), costed['cake']: pytest.approx(2.0)}
+
+def test_bulk_update_without_cost_column_recosts_nothing(session, costed):
+    session.execute(update(Ingredient), [{'id': costed['butter'], 'current_stock': 40.0}])
+
+    pending = session.info['recipe_cost_pending']
+    assert not pending['all'] and not pending['ingredients']
+    session.commit()
+
+def test_query_update_with_where_recosts_every_recipe(session, costed):
+    session.query(Ingredient).filter(Ingredient.name == 'Butter').update({'cost_per_unit': 0.03})
+    session.commit()
+
+    assert stored_costs(session) == {costed['bread']: pytest.approx(1.6), costed['cake']: pytest.approx(3.0)}
+
+def test_bulk_recipe_item_insert_recosts_its_recipe(session, costed):
+    session.execute(insert(RecipeItem), [{'recipe_id': costed['cake'], 'ingredient_id': costed['flour'], 'quantity': 250}])
+    session.commit()
+
+    assert stored_costs(session)[costed['cake']] == pytest.approx(1.5)
+
+def test_bulk_recipe_insert_costs_the_new_recipes(session, costed):
+    session.execute(insert(Recipe), [{'name': 'Scone', 'sale_price': 2.0}, {'name': 'Tart', 'sale_price': 3.0}])
+    session.commit()
+
+    new_ids = {recipe.id for recipe in session.query(Recipe).filter(Recipe.name.in_(['Scone', 'Tart']))}
+    assert new_ids <= set(stored_costs(session))
+
+def test_orm_recipe_delete_drops_its_cost(session, costed):
+    session.delete(session.get(Recipe, costed['cake']))
+    session.commit()
+
+    assert set(stored_costs(session)) == {costed['bread']}
+
+def test_bulk_recipe_delete_drops_its_cost(session, costed):
+    session.execute(delete(RecipeItem).where(RecipeItem.recipe_id == costed['cake']))
+    session.execute(delete(Recipe).where(Recipe.id == costed['cake']))
+    session.commit()
+
+    assert set(stored_costs(session)) == {costed['bread']}
+
+def test_get_margin_changes_reports_moves_biggest_first(session, costed):
+    since = datetime.utcnow() - timedelta(seconds=1)
+    session.get(Ingredient, costed['butter']).cost_per_unit = 0.02
+    session.commit()
+
+    changes = get_margin_changes(session, since)
+
+    assert [change['recipe_id'] for change in changes] == [costed['cake'], costed['bread']]
+    cake = changes[0]
+    assert cake['old_cost'] == pytest.approx(1.0)
+    assert cake['new_cost'] == pytest.approx(2.0)
+    assert cake['old_margin'] == pytest.approx(75.0)
+    assert cake['new_margin'] == pytest.approx(50.0)
+    assert session.info['recipe_cost_changes']
+
+def test_get_margin_changes_ignores_older_changes(session, costed):
+    session.get(Ingredient, costed['butter']).cost_per_unit = 0.02
+    session.commit()
+
+    assert get_margin_changes(session, datetime.utcnow() + timedelta(seconds=1)) == []
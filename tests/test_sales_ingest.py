@@ -0,0 +1,66 @@
+from datetime import datetime
+
+from fake_square import make_orders
+from models import SalesCache
+from sales_ingest import LEGACY_UID_PREFIX, build_sale_key, ingest_orders
+
+from conftest import order_lines
+
+
+def test_ingest_orders_writes_one_row_per_line(session, bakery):
+    lines = order_lines(make_orders(count=20))
+
+    result = ingest_orders(session, lines)
+
+    assert result['imported'] == len(lines)
+    assert result['skipped'] == 0
+    assert session.query(SalesCache).count() == len(lines)
+    assert session.query(SalesCache).filter(SalesCache.recipe_id.is_(None)).count() == 0
+
+def test_ingest_orders_dedupes_on_order_and_line_uid(session, bakery):
+    lines = order_lines(make_orders(count=40))
+    ingest_orders(session, lines[:30])
+
+    # Overlapping refetch, with a duplicate line inside the same fetch too
+    result = ingest_orders(session, lines[10:] + lines[-1:])
+
+    assert result['imported'] == len(lines) - 30
+    assert result['skipped'] == 21
+    assert session.query(SalesCache).count() == len(lines)
+
+def test_same_line_uid_in_different_orders_is_kept(session, bakery):
+    first = order_lines(make_orders(count=1))[0]
+    second = dict(first, order_id='ANOTHER-ORDER')
+
+    assert ingest_orders(session, [first, second])['imported'] == 2
+
+def test_ingest_orders_skips_orders_that_are_not_completed(session, bakery):
+    lines = order_lines(make_orders(count=5))
+    for line in lines[:2]:
+        line['state'] = 'OPEN'
+
+    result = ingest_orders(session, lines)
+
+    assert result['imported'] == len(lines) - 2
+    assert result['not_completed'] == 2
+
+def test_ingest_orders_claims_legacy_rows(session, bakery):
+    line = order_lines(make_orders(count=1))[0]
+    legacy_uid = f"{LEGACY_UID_PREFIX}1"
+    session.add(SalesCache(
+        square_payment_id=build_sale_key(line['order_id'], legacy_uid),
+        order_id=line['order_id'],
+        line_uid=legacy_uid,
+        item_name=line['item_name'],
+        quantity=line['quantity'],
+        total_amount=line['total_amount'],
+        timestamp=datetime.fromisoformat(line['created_at'].replace('Z', ''))
+    ))
+    session.commit()
+
+    result = ingest_orders(session, [line])
+
+    assert result['imported'] == 0
+    row = session.query(SalesCache).one()
+    assert row.line_uid == line['line_uid']
+    assert row.square_payment_id == build_sale_key(line['order_id'], line['line_uid'])
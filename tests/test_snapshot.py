@@ -0,0 +1,28 @@
+import pytest
+from sqlalchemy import update
+
+from fake_square import make_orders
+from models import Ingredient
+from sales_ingest import ingest_orders
+from snapshot import get_snapshot
+
+from conftest import order_lines
+
+
+def test_snapshot_keeps_cost_at_time_of_sale(session, bakery):
+    ingest_orders(session, order_lines(make_orders(count=50, days=10)))
+    before = get_snapshot(session).sales_summary(days=30)
+
+    session.execute(update(Ingredient).values(cost_per_unit=Ingredient.cost_per_unit * 2))
+    session.commit()
+    after = get_snapshot(session).sales_summary(days=30)
+
+    assert before['total_cost'] > 0
+    assert after['total_cost'] == pytest.approx(before['total_cost'])
+    assert after['total_profit'] == pytest.approx(before['total_profit'])
+
+def test_snapshot_copies_are_independent(session, bakery):
+    snapshot = get_snapshot(session)
+    snapshot.recipes['name'] = 'changed'
+
+    assert 'changed' not in set(get_snapshot(session).recipes['name'])
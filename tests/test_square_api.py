@@ -0,0 +1,118 @@
+from datetime import datetime, timedelta
+
+import httpx
+import pytest
+from square.core.api_error import ApiError
+
+import square_api
+from fake_square import FakeSquare, LOCATION_ID, fake_square_api, make_orders, start_fake_square
+from square_api import BACKOFF_MAX, SquareAPI, backoff_delay, is_retryable
+
+
+def test_backoff_delay_uses_retry_after():
+    error = ApiError(status_code=429, headers={'Retry-After': '3'})
+
+    assert backoff_delay(0, error) == 3.0
+    assert backoff_delay(4, error) == 3.0
+
+def test_backoff_delay_caps_retry_after():
+    error = ApiError(status_code=429, headers={'retry-after': str(BACKOFF_MAX * 10)})
+
+    assert backoff_delay(0, error) == BACKOFF_MAX
+
+@pytest.mark.parametrize('retry_after', ['soon', '', None])
+def test_backoff_delay_ignores_unusable_retry_after(retry_after, monkeypatch):
+    monkeypatch.setattr(square_api.random, 'uniform', lambda low, high: high)
+    headers = {'Retry-After': retry_after} if retry_after is not None else {}
+
+    assert backoff_delay(2, ApiError(status_code=503, headers=headers), base=0.5) == 2.0
+
+def test_backoff_delay_grows_exponentially_up_to_cap(monkeypatch):
+    monkeypatch.setattr(square_api.random, 'uniform', lambda low, high: high)
+
+    assert [backoff_delay(attempt, base=0.5) for attempt in range(4)] == [0.5, 1.0, 2.0, 4.0]
+    assert backoff_delay(20, base=0.5) == BACKOFF_MAX
+
+def test_backoff_delay_has_full_jitter():
+    delays = [backoff_delay(3, base=0.5) for _ in range(200)]
+
+    assert all(0 <= delay <= 4.0 for delay in delays)
+    assert len(set(delays)) > 1
+
+@pytest.mark.parametrize('error, retryable', [
+    (ApiError(status_code=429), True),
+    (ApiError(status_code=503), True),
+    (ApiError(status_code=400), False),
+    (ApiError(status_code=401), False),
+    (httpx.ConnectError('refused'), True),
+    (ValueError('bad'), False),
+])
+def test_is_retryable(error, retryable):
+    assert is_retryable(error) == retryable
+
+
+@pytest.fixture
+def fake_api(monkeypatch):
+    """Start a FakeSquare server and return (fake, square_api) pointed at it"""
+    servers = []
+
+    def start(fake):
+        server, base_url = start_fake_square(fake)
+        servers.append(server)
+        # fake_square_api sets these; registering them first restores them afterwards
+        for name in ['SQUARE_ACCESS_TOKEN', 'SQUARE_LOCATION_ID', 'SQUARE_BASE_URL']:
+            monkeypatch.setenv(name, '')
+        return fake_square_api(base_url, backoff_base=0.01)
+
+    yield start
+    for server in servers:
+        server.shutdown()
+
+def test_get_orders_retries_throttled_requests(fake_api):
+    orders = make_orders(count=300, days=10)
+    fake = FakeSquare(orders=orders, rate_429=0.2, retry_after=0)
+    api = fake_api(fake)
+    api.max_retries = 8
+
+    lines = api.get_orders(days_back=30, shards=4)
+
+    assert fake.stats['throttled'] > 0
+    assert {line['order_id'] for line in lines} == {order['id'] for order in orders}
+    assert len(lines) == sum(len(order['line_items']) for order in orders)
+    assert {line['location_id'] for line in lines} == {LOCATION_ID}
+
+def test_fetch_orders_by_ids_raises_after_max_retries(fake_api):
+    api = fake_api(FakeSquare(orders=make_orders(count=5), rate_5xx=1.0))
+    api.max_retries = 2
+
+    with pytest.raises(ApiError) as error:
+        api.fetch_orders_by_ids(['ORDER000001'])
+    assert error.value.status_code == 503
+
+
+def test_sharded_get_orders_matches_sequential(fake_api, monkeypatch):
+    start = datetime(2026, 3, 1)
+    end = start + timedelta(days=4)
+    orders = make_orders(count=200, days=30)
+    for order in orders:
+        created = start + (end - start) * (int(order['id'][5:]) % 97 + 0.5) / 97
+        order['created_at'] = order['updated_at'] = created.strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z'
+
+    # Orders on each inner shard boundary, in both timestamp spellings, and sharing a timestamp
+    shard_bounds = SquareAPI._time_shards(start, end, 4)
+    for position, (boundary, _) in enumerate(shard_bounds[1:]):
+        for spelling in [boundary.isoformat() + 'Z', boundary.isoformat() + '.000Z']:
+            for copy in range(2):
+                order = dict(orders[0], id=f"EDGE{position}{copy}{len(spelling)}")
+                order['created_at'] = order['updated_at'] = spelling
+                orders.append(order)
+
+    api = fake_api(FakeSquare(orders=orders))
+    monkeypatch.setattr(SquareAPI, '_order_window', staticmethod(lambda days_back, updated_since: ('created_at', start, end)))
+
+    sequential = api.get_orders(shards=1)
+    sharded = api.get_orders(shards=4, max_workers=4)
+
+    assert sharded == sequential
+    assert len({line['order_id'] for line in sequential}) == len(orders)
+    assert [line['order_id'] for line in sequential if line['order_id'].startswith('EDGE')]
@@ -0,0 +1,124 @@
+import json
+import os
+
+import pytest
+
+from square_webhooks import OrderQueue, order_id_from_event, sign, verify_signature
+
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures', 'webhooks')
+SIGNATURE_KEY = 'test-signature-key'
+NOTIFICATION_URL = 'https://bakery.example.com/square/webhooks'
+
+
+def load_body(name):
+    with open(os.path.join(FIXTURES, name), 'rb') as f:
+        return f.read()
+
+def load_event(name):
+    return json.loads(load_body(name))
+
+
+def test_verify_signature_accepts_square_signature():
+    body = load_body('order_updated_completed.json')
+    signature = sign(body, SIGNATURE_KEY, NOTIFICATION_URL)
+
+    assert verify_signature(body, signature, SIGNATURE_KEY, NOTIFICATION_URL)
+
+@pytest.mark.parametrize('body, signature_key, notification_url', [
+    (load_body('order_updated_completed.json').replace(b'COMPLETED', b'CANCELED'), SIGNATURE_KEY, NOTIFICATION_URL),
+    (load_body('order_updated_completed.json'), 'another-key', NOTIFICATION_URL),
+    (load_body('order_updated_completed.json'), SIGNATURE_KEY, NOTIFICATION_URL + '/'),
+])
+def test_verify_signature_rejects_tampering(body, signature_key, notification_url):
+    signature = sign(load_body('order_updated_completed.json'), SIGNATURE_KEY, NOTIFICATION_URL)
+
+    assert not verify_signature(body, signature, signature_key, notification_url)
+
+def test_verify_signature_rejects_missing_signature():
+    assert not verify_signature(load_body('order_updated_completed.json'), None, SIGNATURE_KEY, NOTIFICATION_URL)
+
+
+def test_order_id_from_completed_order():
+    assert order_id_from_event(load_event('order_updated_completed.json'), 'LFAKE') == 'ORDER-1'
+
+def test_order_id_ignores_open_orders():
+    assert order_id_from_event(load_event('order_created_open.json'), 'LFAKE') is None
+
+def test_order_id_ignores_other_locations():
+    event = load_event('order_updated_other_location.json')
+
+    assert order_id_from_event(event, 'LFAKE') is None
+    assert order_id_from_event(event) == 'ORDER-2'
+
+def test_order_id_ignores_other_event_types():
+    assert order_id_from_event(load_event('payment_created.json'), 'LFAKE') is None
+
+def test_order_id_falls_back_to_object_order_id():
+    event = load_event('order_updated_completed.json')
+    del event['data']['id']
+
+    assert order_id_from_event(event, 'LFAKE') == 'ORDER-1'
+
+
+def test_redelivered_event_is_queued_once():
+    order_queue = OrderQueue()
+    event = load_event('order_updated_completed.json')
+
+    assert order_queue.add_event(event, 'LFAKE')
+    assert not order_queue.add_event(load_event('order_updated_completed.json'), 'LFAKE')
+    assert order_queue.take_batch(wait=0) == ['ORDER-1']
+    assert order_queue.take_batch(wait=0) == []
+
+def test_updates_to_a_queued_order_are_fetched_once():
+    order_queue = OrderQueue()
+    first = load_event('order_updated_completed.json')
+    second = load_event('order_updated_completed.json')
+    second['event_id'] = 'another-update'
+
+    assert order_queue.add_event(first)
+    assert order_queue.add_event(second)
+    assert order_queue.take_batch(wait=0) == ['ORDER-1']
+
+    # Once taken, a new update queues the order again
+    third = load_event('order_updated_completed.json')
+    third['event_id'] = 'a-later-update'
+    assert order_queue.add_event(third)
+    assert order_queue.take_batch(wait=0) == ['ORDER-1']
+
+
+def _queue_orders(order_queue, order_ids):
+    for order_id in order_ids:
+        event = load_event('order_updated_completed.json')
+        event['event_id'] = f'event-{order_id}'
+        event['data']['id'] = order_id
+        order_queue.add_event(event)
+
+def test_take_batch_respects_size():
+    order_queue = OrderQueue()
+    _queue_orders(order_queue, [f'ORDER-{n}' for n in range(5)])
+
+    assert order_queue.take_batch(size=3, wait=0) == ['ORDER-0', 'ORDER-1', 'ORDER-2']
+    assert order_queue.take_batch(size=3, wait=0) == ['ORDER-3', 'ORDER-4']
+
+def test_take_batch_times_out_when_empty():
+    assert OrderQueue().take_batch(wait=0.05) == []
+
+def test_failed_batch_is_requeued_until_max_attempts():
+    order_queue = OrderQueue()
+    _queue_orders(order_queue, ['ORDER-1', 'ORDER-2'])
+    batch = order_queue.take_batch(wait=0)
+
+    assert order_queue.requeue(batch, max_attempts=2) == []
+    assert order_queue.take_batch(wait=0) == batch
+    assert order_queue.requeue(batch, max_attempts=2) == batch
+    assert order_queue.take_batch(wait=0) == []
+
+def test_done_resets_attempts():
+    order_queue = OrderQueue()
+    _queue_orders(order_queue, ['ORDER-1'])
+    batch = order_queue.take_batch(wait=0)
+
+    order_queue.requeue(batch, max_attempts=2)
+    order_queue.done(order_queue.take_batch(wait=0))
+
+    assert order_queue.requeue(batch, max_attempts=2) == []
@@ -0,0 +1,111 @@
+from datetime import datetime, date, timedelta
+from sqlalchemy import func, select, delete
+from models import SalesCache, RecipeItem, DailyUsage, Settings
+from database import get_setting, set_setting, compare_and_set_setting, upsert_increment
+
+USAGE_WATERMARK_KEY = 'usage_last_sales_id'
+
+def _get_usage_watermark(session):
+    value = get_setting(session, USAGE_WATERMARK_KEY)
+    return int(value) if value else 0
+
+def as_day(value):
+    """func.date() comes back as a string on SQLite and a date on Postgres"""
+    if isinstance(value, str):
+        value = date.fromisoformat(value[:10])
+    if isinstance(value, datetime):
+        value = value.date()
+    return datetime.combine(value, datetime.min.time())
+
+def _aggregate_usage(session, *filters):
+    """Explode sales through their recipes in SQL: total usage per (day, ingredient)"""
+    day = func.date(SalesCache.timestamp)
+    rows = session.execute(
+        select(
+            day,
+            RecipeItem.ingredient_id,
+            func.sum(SalesCache.quantity * RecipeItem.quantity)
+        ).join(
+            RecipeItem, RecipeItem.recipe_id == SalesCache.recipe_id
+        ).where(*filters).group_by(day, RecipeItem.ingredient_id)
+    ).all()
+
+    return [{
+        'date': as_day(sale_day),
+        'ingredient_id': ingredient_id,
+        'quantity_used': quantity_used or 0.0
+    } for sale_day, ingredient_id, quantity_used in rows]
+
+def _add_usage(session, rows):
+    """Add quantities onto DailyUsage, creating (ingredient, day) rows as needed"""
+    upsert_increment(session, DailyUsage, rows, ['ingredient_id', 'date'], ['quantity_used'])
+
+def update_usage_from_sales(session):
+    """
+    Incremental stage run after each sales ingestion: account ingredient usage
+    for SalesCache rows newer than the stored id watermark. The range is claimed
+    by a compare-and-set on the watermark before it is counted, and the upsert
+    commits with it, so neither a rerun nor a concurrent ingest double-counts.
+    Claiming up to max(id) relies on ingest_orders' lock: sales commit in id
+    order, so no lower id can commit after the watermark passes it.
+    Returns the number of (day, ingredient) rows touched.
+    """
+    while True:
+        # Read the column, not the ORM row, so a retry sees the other writer's value
+        watermark = session.execute(select(Settings.value).where(Settings.key == USAGE_WATERMARK_KEY)).scalar()
+        last_id = int(watermark) if watermark else 0
+        max_id = session.query(func.max(SalesCache.id)).scalar() or 0
+
+        if max_id <= last_id:
+            return 0
+
+        if compare_and_set_setting(session, USAGE_WATERMARK_KEY, watermark, str(max_id)):
+            break
+        session.rollback()
+
+    rows = _aggregate_usage(
+        session,
+        SalesCache.id > last_id,
+        SalesCache.id <= max_id,
+        SalesCache.recipe_id.isnot(None)
+    )
+    if rows:
+        _add_usage(session, rows)
+
+    session.commit()
+    return len(rows)
+
+def rebuild_daily_usage(session, start_date=None, end_date=None):
+    """
+    Backfill mode: recompute DailyUsage from scratch for a date range (or all of
+    history), e.g. after recipes change or old sales are mapped to recipes.
+    Only sales already behind the watermark are recounted; newer ones are left
+    to the incremental stage. Returns the number of (day, ingredient) rows written.
+    """
+    last_id = _get_usage_watermark(session)
+
+    if start_date is None and end_date is None:
+        # Full rebuild takes over everything ingested so far
+        last_id = session.query(func.max(SalesCache.id)).scalar() or 0
+
+    usage_filters = []
+    sales_filters = [SalesCache.id <= last_id, SalesCache.recipe_id.isnot(None)]
+
+    if start_date is not None:
+        start = as_day(start_date)
+        usage_filters.append(DailyUsage.date >= start)
+        sales_filters.append(SalesCache.timestamp >= start)
+    if end_date is not None:
+        end = as_day(end_date)
+        usage_filters.append(DailyUsage.date <= end)
+        sales_filters.append(SalesCache.timestamp < end + timedelta(days=1))
+
+    session.execute(delete(DailyUsage).where(*usage_filters))
+
+    rows = _aggregate_usage(session, *sales_filters)
+    if rows:
+        _add_usage(session, rows)
+
+    set_setting(session, USAGE_WATERMARK_KEY, str(last_id))
+    session.commit()
+    return len(rows)
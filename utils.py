@@ -1,19 +1,26 @@
 from datetime import datetime, timedelta
-from sqlalchemy import func
-from models import Ingredient, Recipe, RecipeItem, SalesCache, DailyUsage
-import pandas as pd
+from sqlalchemy import func, or_, and_, update, insert
+from sqlalchemy.orm import selectinload
+from models import (
+    Ingredient, Recipe, RecipeItem, RecipeCost, SalesCache, SalesDaily, DailyUsage,
+    SupplierOrder, SupplierOrderItem, StockAdjustment
+)
 import streamlit as st
+from data_versions import cached_on
+from recipe_costing import recipe_unit_costs
+from usage_accounting import as_day
 
 def format_currency(amount):
     """Format amount as GBP currency"""
     return f"£{amount:,.2f}"
 
-@st.cache_data(ttl=3600)  # Cache for 1 hour
+@st.cache_data(ttl=300)  # Cache for 5 minutes - incremental syncs are cheap
 def auto_sync_square_sales(days_back=30):
-    """Automatically sync sales data from Square on app startup (cached for 1 hour)"""
+    """Incrementally sync sales data from Square since the last stored watermark (cached for 5 minutes)"""
     try:
         from square_api import SquareAPI
-        from database import get_session, close_session
+        from database import get_session_factory
+        from sales_ingest import sync_square_sales
 
         square_api = SquareAPI()
 
@@ -21,247 +28,257 @@ def auto_sync_square_sales(days_back=30):
         if not square_api.is_configured:
             return None
 
-        session = get_session()
+        # Its own session, not the page's: a failed sync must not leave the
+        # shared per-run session needing a rollback
+        session = get_session_factory()()
 
         try:
-            orders = square_api.get_orders(days_back=days_back)
+            result = sync_square_sales(session, square_api, days_back=days_back)
 
-            if not orders:
+            if not result['total_orders']:
                 return None
 
-            imported = 0
-
-            for order in orders:
-                try:
-                    unique_id = f"{order['order_id']}_{order['item_name']}"
-
-                    # Check if already imported
-                    existing = session.query(SalesCache).filter(
-                        SalesCache.square_payment_id == unique_id
-                    ).first()
-
-                    if not existing:
-                        new_sale = SalesCache(
-                            square_payment_id=unique_id,
-                            item_name=order['item_name'],
-                            quantity=order['quantity'],
-                            total_amount=order['total_amount'],
-                            timestamp=datetime.fromisoformat(order['created_at'].replace('Z', '+00:00'))
-                        )
-                        session.add(new_sale)
-                        imported += 1
-                except Exception:
-                    continue  # Skip failed orders silently
-
-            session.commit()
-
             return {
-                'imported': imported,
-                'total_orders': len(orders),
+                'imported': result['imported'],
+                'total_orders': result['total_orders'],
                 'synced_at': datetime.utcnow()
             }
 
         finally:
-            close_session(session)
+            session.close()
 
     except Exception:
         # Fail silently - don't break the app if Square sync fails
         return None
 
+def get_units_sold_by_recipe(session, start_date=None):
+    """Units sold per recipe id from the sales_daily rollup (unmapped sales are excluded)"""
+    return _units_sold_by_recipe(session, as_day(start_date) if start_date is not None else None)
+
+@cached_on('sales_daily')
+def _units_sold_by_recipe(session, start_day):
+    query = session.query(SalesDaily.recipe_id, func.sum(SalesDaily.units)).filter(
+        SalesDaily.recipe_id.isnot(None)
+    )
+    if start_day is not None:
+        query = query.filter(SalesDaily.business_date >= start_day)
+
+    return {recipe_id: units or 0 for recipe_id, units in query.group_by(SalesDaily.recipe_id).all()}
+
+def calculate_recipe_costs(session, recipe_ids=None):
+    """
+    Cost, profit and margin for every recipe (or just recipe_ids).
+    Returns {recipe_id: (cost, profit, margin_percent)}.
+    """
+    costs = _all_recipe_costs(session)
+    if recipe_ids is None:
+        return costs
+    return {recipe_id: costs[recipe_id] for recipe_id in recipe_ids if recipe_id in costs}
+
+@cached_on('recipe_costs', 'recipes')
+def _all_recipe_costs(session):
+    """Precomputed costs from recipe_costs; any recipe without a row yet is costed live"""
+    rows = session.query(
+        Recipe.id,
+        RecipeCost.cost,
+        RecipeCost.profit,
+        RecipeCost.margin
+    ).outerjoin(RecipeCost, RecipeCost.recipe_id == Recipe.id).all()
+
+    costs = {recipe_id: (cost, profit, margin) for recipe_id, cost, profit, margin in rows if cost is not None}
+
+    missing = [recipe_id for recipe_id, cost, _, _ in rows if cost is None]
+    if missing:
+        item_costs = recipe_unit_costs(session)
+        for recipe_id, sale_price, cost in session.query(
+            Recipe.id,
+            Recipe.sale_price,
+            func.coalesce(item_costs.c.cost, 0.0)
+        ).outerjoin(item_costs, item_costs.c.recipe_id == Recipe.id).filter(Recipe.id.in_(missing)):
+            sale_price = sale_price or 0.0
+            profit = sale_price - cost
+            margin_percent = (profit / sale_price * 100) if sale_price > 0 else 0
+            costs[recipe_id] = (cost, profit, margin_percent)
+
+    return costs
+
 def calculate_recipe_cost(session, recipe_id):
-    recipe = session.query(Recipe).filter_by(id=recipe_id).first()
-    if not recipe:
-        return 0.0
-    
-    total_cost = 0.0
-    for recipe_item in recipe.recipe_items:
-        ingredient = recipe_item.ingredient
-        total_cost += ingredient.cost_per_unit * recipe_item.quantity
-    
-    return total_cost
+    return calculate_recipe_costs(session, [recipe_id]).get(recipe_id, (0.0, 0.0, 0.0))[0]
 
 def calculate_profit_margin(session, recipe_id):
-    recipe = session.query(Recipe).filter_by(id=recipe_id).first()
-    if not recipe:
-        return 0.0, 0.0, 0.0
-    
-    cost = calculate_recipe_cost(session, recipe_id)
-    profit = recipe.sale_price - cost
-    margin_percent = (profit / recipe.sale_price * 100) if recipe.sale_price > 0 else 0
-    
-    return cost, profit, margin_percent
+    return calculate_recipe_costs(session, [recipe_id]).get(recipe_id, (0.0, 0.0, 0.0))
+
+@cached_on('ingredients', 'daily_usage')
+def get_stock_status(session, days=14, safety_stock_days=3):
+    """
+    Daily usage, reorder point, days remaining and urgency for every ingredient
+    from one grouped DailyUsage query. Returns a DataFrame with one row per ingredient.
+    """
+    import numpy as np
+    import pandas as pd
 
-def get_daily_usage_rate(session, ingredient_id, days=7):
     start_date = datetime.utcnow() - timedelta(days=days)
     
-    usage_records = session.query(DailyUsage).filter(
-        DailyUsage.ingredient_id == ingredient_id,
-        DailyUsage.date >= start_date
-    ).all()
+    df = pd.DataFrame(
+        session.query(
+            Ingredient.id,
+            Ingredient.name,
+            Ingredient.unit,
+            Ingredient.current_stock,
+            Ingredient.supplier_lead_time_days
+        ).order_by(Ingredient.id).all(),
+        columns=['ingredient_id', 'name', 'unit', 'current_stock', 'lead_time_days']
+    )
     
-    if not usage_records:
-        return 0.0
+    usage = dict(session.query(
+        DailyUsage.ingredient_id,
+        func.sum(DailyUsage.quantity_used)
+    ).filter(
+        DailyUsage.date >= start_date
+    ).group_by(DailyUsage.ingredient_id).all())
     
-    total_used = sum(record.quantity_used for record in usage_records)
-    avg_daily_usage = total_used / days
+    df['current_stock'] = df['current_stock'].fillna(0.0).astype(float)
+    df['lead_time_days'] = df['lead_time_days'].fillna(7).astype(int)
+    df['daily_usage'] = df['ingredient_id'].map(usage).fillna(0.0).astype(float) / days
+    df['reorder_point'] = df['daily_usage'] * (df['lead_time_days'] + safety_stock_days)
     
-    return avg_daily_usage
-
-def calculate_reorder_threshold(session, ingredient):
-    avg_daily_usage = get_daily_usage_rate(session, ingredient.id, days=14)
-    lead_time = ingredient.supplier_lead_time_days
-    safety_stock_days = 3
+    using = df['daily_usage'] > 0
+    df['days_remaining'] = 999.0
+    df.loc[using, 'days_remaining'] = df.loc[using, 'current_stock'] / df.loc[using, 'daily_usage']
     
-    reorder_point = avg_daily_usage * (lead_time + safety_stock_days)
+    days_remaining = df['days_remaining']
+    df['urgency'] = np.select([days_remaining < 2, days_remaining < 5], ['critical', 'warning'], 'notice')
+    df['status'] = np.select(
+        [days_remaining < 2, days_remaining < 5, days_remaining < 10],
+        ['Critical', 'Low', 'Warning'],
+        'Good'
+    )
+    df['is_low'] = df['current_stock'] <= df['reorder_point']
     
-    return reorder_point, avg_daily_usage
+    return df
 
-def get_low_stock_ingredients(session):
-    ingredients = session.query(Ingredient).all()
-    low_stock = []
+def get_low_stock_ingredients(session, stock_status=None):
+    if stock_status is None:
+        stock_status = get_stock_status(session)
+    
+    low = stock_status[stock_status['is_low']].sort_values('days_remaining', kind='stable')
+    if low.empty:
+        return []
     
-    for ingredient in ingredients:
-        reorder_point, daily_usage = calculate_reorder_threshold(session, ingredient)
-        
-        if ingredient.current_stock <= reorder_point:
-            days_remaining = ingredient.current_stock / daily_usage if daily_usage > 0 else 999
-            
-            low_stock.append({
-                'ingredient': ingredient,
-                'current_stock': ingredient.current_stock,
-                'reorder_point': reorder_point,
-                'daily_usage': daily_usage,
-                'days_remaining': days_remaining,
-                'urgency': 'critical' if days_remaining < 2 else 'warning' if days_remaining < 5 else 'notice'
-            })
+    ingredients = {
+        ingredient.id: ingredient
+        for ingredient in session.query(Ingredient).filter(Ingredient.id.in_(low['ingredient_id'].tolist()))
+    }
     
-    low_stock.sort(key=lambda x: x['days_remaining'])
-    return low_stock
+    return [{
+        'ingredient': ingredients[row.ingredient_id],
+        'current_stock': row.current_stock,
+        'reorder_point': row.reorder_point,
+        'daily_usage': row.daily_usage,
+        'days_remaining': row.days_remaining,
+        'urgency': row.urgency
+    } for row in low.itertuples()]
 
 def update_daily_usage(session, date=None):
+    """Recompute ingredient usage for one day (defaults to today) from its sales"""
+    from usage_accounting import rebuild_daily_usage
+    
     if date is None:
         date = datetime.utcnow().date()
     
-    sales = session.query(SalesCache).filter(
-        func.date(SalesCache.timestamp) == date
-    ).all()
-    
-    for sale in sales:
-        recipe = session.query(Recipe).filter_by(name=sale.item_name).first()
-        
-        if recipe:
-            for recipe_item in recipe.recipe_items:
-                quantity_used = recipe_item.quantity * sale.quantity
-                
-                existing_usage = session.query(DailyUsage).filter(
-                    DailyUsage.ingredient_id == recipe_item.ingredient_id,
-                    func.date(DailyUsage.date) == date
-                ).first()
-                
-                if existing_usage:
-                    existing_usage.quantity_used += quantity_used
-                else:
-                    new_usage = DailyUsage(
-                        ingredient_id=recipe_item.ingredient_id,
-                        date=datetime.combine(date, datetime.min.time()),
-                        quantity_used=quantity_used
-                    )
-                    session.add(new_usage)
-    
-    session.commit()
+    rebuild_daily_usage(session, start_date=date, end_date=date)
 
 def generate_business_recommendations(session):
-    recommendations = []
-    
-    recipes = session.query(Recipe).all()
-    profit_data = []
-    
-    for recipe in recipes:
-        cost, profit, margin = calculate_profit_margin(session, recipe.id)
-        
-        sales_count = session.query(func.sum(SalesCache.quantity)).filter(
-            SalesCache.item_name == recipe.name
-        ).scalar() or 0
-        
-        profit_data.append({
-            'name': recipe.name,
-            'cost': cost,
-            'profit': profit,
-            'margin': margin,
-            'sales_count': sales_count,
-            'total_profit': profit * sales_count
-        })
-    
-    if profit_data:
-        df = pd.DataFrame(profit_data)
-        
-        high_margin_items = df[df['margin'] > 60].sort_values('margin', ascending=False)
-        if not high_margin_items.empty:
-            top_item = high_margin_items.iloc[0]
-            recommendations.append({
-                'type': 'promote',
-                'priority': 'high',
-                'message': f"🌟 '{top_item['name']}' has a {top_item['margin']:.1f}% profit margin. Consider promoting it more heavily."
-            })
-        
-        low_margin_items = df[df['margin'] < 20].sort_values('sales_count', ascending=False)
-        if not low_margin_items.empty:
-            top_low = low_margin_items.iloc[0]
-            recommendations.append({
-                'type': 'optimize',
-                'priority': 'medium',
-                'message': f"⚠️ '{top_low['name']}' has only {top_low['margin']:.1f}% margin. Consider raising prices or reducing ingredient costs."
-            })
-        
-        if len(df) > 0:
-            best_profit = df.sort_values('total_profit', ascending=False).iloc[0]
-            best_sales = df.sort_values('sales_count', ascending=False).iloc[0]
-            
-            if best_profit['name'] != best_sales['name']:
-                recommendations.append({
-                    'type': 'insight',
-                    'priority': 'medium',
-                    'message': f"💡 '{best_sales['name']}' sells best, but '{best_profit['name']}' generates more total profit. Balance your menu accordingly."
-                })
+    from snapshot import get_snapshot
+    return get_snapshot(session).recommendations()
+
+def get_sales_summary(session, days=30):
+    from snapshot import get_snapshot
+    return get_snapshot(session).sales_summary(days)
+
+def get_supplier_orders_page(session, cursor=None, page_size=20, statuses=None, supplier_id=None,
+                             start_date=None, end_date=None):
+    """
+    One page of supplier orders, newest first, with supplier, items and
+    ingredients loaded in three selectin queries. cursor is the
+    (order_date, id) of the last order on the previous page.
+    Returns (orders, next_cursor), next_cursor being None on the last page.
+    """
+    query = session.query(SupplierOrder).options(
+        selectinload(SupplierOrder.supplier),
+        selectinload(SupplierOrder.order_items).selectinload(SupplierOrderItem.ingredient)
+    )
     
-    low_stock = get_low_stock_ingredients(session)
-    critical_items = [item for item in low_stock if item['urgency'] == 'critical']
+    if statuses:
+        query = query.filter(SupplierOrder.status.in_(statuses))
+    if supplier_id is not None:
+        query = query.filter(SupplierOrder.supplier_id == supplier_id)
+    if start_date is not None:
+        query = query.filter(SupplierOrder.order_date >= start_date)
+    if end_date is not None:
+        query = query.filter(SupplierOrder.order_date < end_date)
+    if cursor is not None:
+        cursor_date, cursor_id = cursor
+        query = query.filter(or_(
+            SupplierOrder.order_date < cursor_date,
+            and_(SupplierOrder.order_date == cursor_date, SupplierOrder.id < cursor_id)
+        ))
     
-    if critical_items:
-        ingredient_names = ', '.join([item['ingredient'].name for item in critical_items[:3]])
-        recommendations.append({
-            'type': 'urgent',
-            'priority': 'critical',
-            'message': f"🚨 URGENT: Low stock on {ingredient_names}. Order immediately!"
-        })
+    orders = query.order_by(SupplierOrder.order_date.desc(), SupplierOrder.id.desc()).limit(page_size + 1).all()
     
-    return recommendations
+    if len(orders) > page_size:
+        orders = orders[:page_size]
+        return orders, (orders[-1].order_date, orders[-1].id)
+    return orders, None
 
-def get_sales_summary(session, days=30):
-    start_date = datetime.utcnow() - timedelta(days=days)
+def get_recent_orders_by_supplier(session, limit=5):
+    """The latest `limit` orders of every supplier in one windowed query: {supplier_id: [orders]}"""
+    ranked = session.query(
+        SupplierOrder.id.label('order_id'),
+        func.row_number().over(
+            partition_by=SupplierOrder.supplier_id,
+            order_by=(SupplierOrder.order_date.desc(), SupplierOrder.id.desc())
+        ).label('position')
+    ).subquery()
     
-    sales = session.query(SalesCache).filter(
-        SalesCache.timestamp >= start_date
+    orders = session.query(SupplierOrder).join(
+        ranked, ranked.c.order_id == SupplierOrder.id
+    ).filter(ranked.c.position <= limit).order_by(
+        SupplierOrder.supplier_id, SupplierOrder.order_date.desc(), SupplierOrder.id.desc()
     ).all()
     
-    total_revenue = sum(sale.total_amount for sale in sales)
-    total_items = sum(sale.quantity for sale in sales)
-    
-    total_cost = 0.0
-    for sale in sales:
-        recipe = session.query(Recipe).filter_by(name=sale.item_name).first()
-        if recipe:
-            cost = calculate_recipe_cost(session, recipe.id)
-            total_cost += cost * sale.quantity
+    by_supplier = {}
+    for order in orders:
+        by_supplier.setdefault(order.supplier_id, []).append(order)
+    return by_supplier
+
+def apply_stock_changes(session, previous, new_levels, reason='stocktake'):
+    """
+    Write only the ingredients whose level differs from what was loaded, as one
+    bulk UPDATE, and record each change as a StockAdjustment. previous and
+    new_levels are {ingredient_id: stock}. Returns the number of ingredients changed.
+    """
+    now = datetime.utcnow()
+    changed = {
+        ingredient_id: float(new_stock)
+        for ingredient_id, new_stock in new_levels.items()
+        if abs(float(new_stock) - float(previous.get(ingredient_id) or 0.0)) > 1e-9
+    }
+    if not changed:
+        return 0
     
-    total_profit = total_revenue - total_cost
-    avg_profit_margin = (total_profit / total_revenue * 100) if total_revenue > 0 else 0
+    session.execute(update(Ingredient), [
+        {'id': ingredient_id, 'current_stock': new_stock, 'last_updated': now}
+        for ingredient_id, new_stock in changed.items()
+    ])
+    session.execute(insert(StockAdjustment), [{
+        'ingredient_id': ingredient_id,
+        'previous_stock': float(previous.get(ingredient_id) or 0.0),
+        'new_stock': new_stock,
+        'change': new_stock - float(previous.get(ingredient_id) or 0.0),
+        'reason': reason,
+        'created_at': now
+    } for ingredient_id, new_stock in changed.items()])
+    session.commit()
     
-    return {
-        'total_revenue': total_revenue,
-        'total_cost': total_cost,
-        'total_profit': total_profit,
-        'avg_profit_margin': avg_profit_margin,
-        'total_items_sold': total_items,
-        'num_transactions': len(sales)
-    }
+    return len(changed)